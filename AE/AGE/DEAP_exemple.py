@@ -2,13 +2,18 @@ import deap as dp
 import project
 from deap import creator, base, tools
 
-from AE.AGE.age_genome import acrobot_genome, build_net, standard_mutate_rate
+from AE.AGE.age_genome import acrobot_genome, build_net, build_network, standard_mutate_rate, population_chrom_cross, pair_chrom_cross
 
 
 from AE.AGE.age_genome import fitness as fit_realistic_devices
+from AE.AGE.parallel import population_evaluator
+from AE.AGE.steady_state import steady_state_evolve
+from AE.AGE.acrobot import simulate, population_torques
+from AE.Network.Population import Population
 from copy import deepcopy, copy
 from matplotlib import pyplot as plt
 import random
+import atexit
 import numpy as np
 import time
 random.seed(0)
@@ -26,15 +31,36 @@ toolbox.register("population", tools.initRepeat, list, creator.Individual)
 
 
 
-# def evalAcrobotAGE(indiv):
-#     net_AM, net_struct = indiv.build_devices(sum([indiv.extract_devices(k) for k in range(len(indiv.chromosomes))], start = []))
-#     net = build_net(net_AM, net_struct)
+# Weight of the acrobot swing-up (mean tip height over an episode, in [-2, 2]) in the fitness
+simulation_weight = 10
 
-#     # TODO : evaluate_simulation(net)
-#     return [fit_realistic_devices(net_AM, net_struct)]
+def evaluate_simulation(net):
+    return simulate([net])[0]
 
+def evalAcrobotAGE(indiv):
+    net_AM, net_struct = indiv.build_devices(sum([indiv.extract_devices(k) for k in range(len(indiv.chromosomes))], start = []))
+    net = build_net(net_AM, net_struct)
 
-# toolbox.register("evaluate", evalAcrobotAGE)
+    return [fit_realistic_devices(net_AM, net_struct) + simulation_weight*evaluate_simulation(net)]
+
+# Fitness of evalAcrobotAGE for a whole population, with a single (batched) simulation of the stacked networks
+# Networks foundations are built through toolbox.map, so possibly in a process pool
+def evalPopulationAcrobotAGE(individuals):
+    foundations = list(toolbox.map(build_network, individuals))
+    controllers = Population([build_net(net_AM, net_struct) for net_AM, net_struct in foundations])
+    heights = simulate(controllers, policy = population_torques)
+    return [[fit_realistic_devices(net_AM, net_struct) + simulation_weight*h] for (net_AM, net_struct), h in zip(foundations, heights)]
+
+
+toolbox.register("evaluate", evalAcrobotAGE)
+toolbox.register("evaluate_population", evalPopulationAcrobotAGE)
+
+# Evaluations go through evaluator.map : with n_workers > 1 (None for all cores) they run in a process pool,
+# results coming back in order; the evaluator can also be handed to evolve_steady_state
+n_workers = 1
+evaluator = population_evaluator(n_workers)
+toolbox.register("map", evaluator.map)
+atexit.register(evaluator.close)
 
 
 def mutate_age_genome(g, m_rates = standard_mutate_rate):
@@ -54,8 +80,8 @@ def initialise_pop(n_pop = 100, n_gens = 200):
     pop = toolbox.population(n=n_pop)
 
 
-    # Initialize fitness
-    fitnesses = list(map(toolbox.evaluate, pop))
+    # Initialize fitness
+    fitnesses = toolbox.evaluate_population(pop)
     for ind, fit in zip(pop, fitnesses):
         ind.fitness.values = fit
 
@@ -86,10 +112,12 @@ def evolve(pop, fits, all_fits, generation = 0, n_gens = 200, max_fitness = 70,
         for mutant in offspring:
             toolbox.mutate(mutant)
             del mutant.fitness.values
+        # chromosome crossover is rolled at the population level
+        population_chrom_cross(offspring, standard_mutate_rate[10])
 
         # Evaluate the individuals with an invalid fitness
         invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fitnesses = map(toolbox.evaluate, invalid_ind)
+        fitnesses = toolbox.evaluate_population(invalid_ind)
         for ind, fit in zip(invalid_ind, fitnesses):
             ind.fitness.values = fit
 
@@ -131,4 +159,31 @@ def evolve(pop, fits, all_fits, generation = 0, n_gens = 200, max_fitness = 70,
     plt.xlabel('Generation')
     plt.show()
 
-    return best_ind, np_all_fits
\ No newline at end of file
+    return best_ind, np_all_fits
+
+
+# Steady-state alternative to evolve : no generational barrier, each offspring is inserted as soon as it is evaluated
+# pop has to be evaluated already (see initialise_pop)
+def evolve_steady_state(pop, evaluator, n_evaluations = 20000, verbose = False):
+
+    def mutate(ind):
+        toolbox.mutate(ind)
+        del ind.fitness.values
+
+    def report(n_done, population, fitnesses):
+        if verbose and (n_done + 1) % len(population) == 0:
+            print("-- %i evaluations --" % (n_done + 1))
+            print("  Max %s" % max(fitnesses)[0])
+
+    pop, fits = steady_state_evolve(pop, toolbox.evaluate, mutate, evaluator, n_evaluations, 
+                                    fitnesses = [list(ind.fitness.values) for ind in pop], clone = toolbox.clone, callback = report,
+                                    crossover = lambda ind, mate : pair_chrom_cross(ind, mate, standard_mutate_rate[10]))
+    for ind, fit in zip(pop, fits):
+        ind.fitness.values = fit
+
+    print("-- End of (steady-state) evolution --")
+
+    best_ind = tools.selBest(pop, 1)[0]
+    print("Best individual is %s, %s" % (best_ind, best_ind.fitness.values))
+
+    return best_ind, pop
@@ -0,0 +1,112 @@
+# Acrobot physics, for many independent acrobots at once
+#
+# Two-link pendulum actuated at the joint between the links, with the dynamics and parameters of the classic
+# control benchmark (Sutton & Barto; same as gym's Acrobot-v1, 'book' dynamics) but with a continuous torque.
+# The state of each acrobot is (theta1, theta2, dtheta1, dtheta2) : theta1 is the angle of the first link from
+# the downward vertical, theta2 the angle of the second link relative to the first one.
+
+import numpy as np
+
+class acrobot_batch():
+    link_length_1 = 1.
+    link_mass_1 = 1.
+    link_mass_2 = 1.
+    link_com_pos_1 = .5     # position of the center of mass of link 1
+    link_com_pos_2 = .5
+    link_moi = 1.           # moments of inertia of both links
+    gravity = 9.8
+    max_vel_1 = 4*np.pi
+    max_vel_2 = 9*np.pi
+    # slightly off the resting equilibrium, as the random starts of the benchmark (uniform in [-.1, .1])
+    default_initial_state = (.05, -.05, 0., 0.)
+
+    def __init__(self, n_envs, dt = .2, max_torque = 1.):
+        self.n_envs = n_envs
+        self.dt = dt
+        self.max_torque = max_torque
+        self.state = np.zeros((n_envs, 4))
+
+    # initial_state : (4,) or (n_envs, 4)
+    # By default, the fixed default_initial_state : a controller always gets the same score, and evaluations draw nothing
+    # from the random streams (random starts can be drawn from a dedicated stream and passed explicitly)
+    def reset(self, initial_state = None):
+        if initial_state is None:
+            initial_state = self.default_initial_state
+        self.state = np.array(np.broadcast_to(initial_state, (self.n_envs, 4)), dtype = float)
+        return self.state
+
+    # Time derivative of the states s (n, 4) under torques (n,)
+    def derivatives(self, s, torque):
+        m1, m2, l1 = self.link_mass_1, self.link_mass_2, self.link_length_1
+        lc1, lc2, I1, I2, g = self.link_com_pos_1, self.link_com_pos_2, self.link_moi, self.link_moi, self.gravity
+        theta1, theta2, dtheta1, dtheta2 = s.T
+
+        d1 = m1*lc1**2 + m2*(l1**2 + lc2**2 + 2*l1*lc2*np.cos(theta2)) + I1 + I2
+        d2 = m2*(lc2**2 + l1*lc2*np.cos(theta2)) + I2
+        phi2 = m2*lc2*g*np.cos(theta1 + theta2 - np.pi/2)
+        phi1 = (- m2*l1*lc2*dtheta2**2*np.sin(theta2) - 2*m2*l1*lc2*dtheta2*dtheta1*np.sin(theta2)
+                + (m1*lc1 + m2*l1)*g*np.cos(theta1 - np.pi/2) + phi2)
+        ddtheta2 = (torque + d2/d1*phi1 - m2*l1*lc2*dtheta1**2*np.sin(theta2) - phi2) / (m2*lc2**2 + I2 - d2**2/d1)
+        ddtheta1 = -(d2*ddtheta2 + phi1)/d1
+        return np.stack((dtheta1, dtheta2, ddtheta1, ddtheta2), axis = 1)
+
+    # One dt for every acrobot (4th order Runge-Kutta, torque held constant), torques in [-1, 1] * max_torque
+    def step(self, torque):
+        torque = self.max_torque * np.clip(np.broadcast_to(torque, (self.n_envs,)), -1, 1)
+        s, dt = self.state, self.dt
+        k1 = self.derivatives(s, torque)
+        k2 = self.derivatives(s + dt/2*k1, torque)
+        k3 = self.derivatives(s + dt/2*k2, torque)
+        k4 = self.derivatives(s + dt*k3, torque)
+        s = s + dt/6*(k1 + 2*k2 + 2*k3 + k4)
+
+        # angles in [-pi, pi), bounded velocities
+        s[:, :2] = (s[:, :2] + np.pi) % (2*np.pi) - np.pi
+        s[:, 2] = np.clip(s[:, 2], -self.max_vel_1, self.max_vel_1)
+        s[:, 3] = np.clip(s[:, 3], -self.max_vel_2, self.max_vel_2)
+        self.state = s
+        return s
+
+    # Height of the tip of the second link above the pivot, in [-2, 2] (the swing-up goal is height > 1)
+    def height(self):
+        theta1, theta2 = self.state[:, 0], self.state[:, 1]
+        return -np.cos(theta1) - np.cos(theta1 + theta2)
+
+    # Controller inputs : both angles and both velocities, scaled to [-1, 1]
+    def observe(self):
+        return self.state / np.array([np.pi, np.pi, self.max_vel_1, self.max_vel_2])
+
+
+# Torques given by one ANN controller per acrobot : controller i reads the first nIn observations of acrobot i
+# (zeros beyond the 4 available) and its first output is the torque (0 for networks without output)
+def controller_torques(controllers, observations):
+    torques = np.zeros(len(controllers))
+    for i, net in enumerate(controllers):
+        if len(net.OUT) == 0:
+            continue
+        inputs = np.zeros(len(net.IN))
+        n = min(len(net.IN), observations.shape[1])
+        inputs[:n] = observations[i, :n]
+        torques[i] = net.process(inputs)[0]
+    return torques
+
+# Batched alternative to controller_torques, the controllers being stacked in an AE.Network.Population.Population
+def population_torques(population, observations):
+    if population.nOut == 0:
+        return np.zeros(len(population))
+    inputs = np.zeros((len(population), population.nIn))
+    n = min(population.nIn, observations.shape[1])
+    inputs[:, :n] = observations[:, :n]
+    return population.process(inputs)[:, 0]
+
+# Simulates one acrobot per controller, all at once; returns the mean height of each acrobot over the episode
+# policy(controllers, observations) -> torques can replace controller_torques, e.g. population_torques with controllers
+# stacked in a Population
+def simulate(controllers, n_steps = 500, initial_state = None, dt = .2, max_torque = 1., policy = controller_torques):
+    env = acrobot_batch(len(controllers), dt, max_torque)
+    env.reset(initial_state)
+    heights = np.zeros(len(controllers))
+    for t in range(n_steps):
+        env.step(policy(controllers, env.observe()))
+        heights += env.height()
+    return heights / n_steps
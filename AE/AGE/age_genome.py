@@ -1,16 +1,21 @@
 # genetic alphabet -> actual latin one '(26 characters seems to be enough)
 # define device set
 import string
+import hashlib
 import numpy as np
 from functools import partial
 from copy import deepcopy, copy
 from time import time as time
-from itertools import islice
-from AE.AGE.string_alignement import rng    # check string_alignment for rng seeding (maybe create a separate file for it ?)
+from itertools import islice, compress
+from scipy import sparse as sp
+from AE.AGE.rng_streams import rng    # check rng_streams for rng seeding
 import matplotlib.pyplot as plt
 
 from AE.AGE.string_alignement import score_alignement_with_history_and_silencing as score_alignement, score_n_alignment_to_ref as multi_score_alignement, alignement_history
 from AE.AGE.string_alignement import many_exact_matching_with_nan_padding as many_exact_score
+from AE.AGE.string_alignement import complement_table, transform, transform_batch
+from AE.AGE.token_scanner import get_scanner
+from AE.AGE.device_codec import encode_device, encode_layout, pack_chromosomes, unpack_chromosomes, check_alphabet
 
 
 from AE.Network import ANN as ann
@@ -36,10 +41,35 @@ def random_letter():
 # random_sequence = lambda n : rng.choice(genetic_alphabet, size = n)
 def random_sequence(n):
     return rng.choice(genetic_alphabet, size = n)
+# Replaces chrom[start:stop] by segment : in place for lists, by concatenation for arrays
+def splice(chrom, start, stop, segment):
+    if isinstance(chrom, np.ndarray):
+        return np.concatenate((chrom[:start], segment, chrom[stop:]))
+    chrom[start:stop] = segment
+    return chrom
+
+# Configurations shared by genomes, by configuration_key (see genome.share_configuration)
+shared_configurations = {}
+
+# shared is the configuration carried by the pickle (written once per pickle, however many genomes share it) ; it is
+# registered by the first genome unpickled with it, so that a process that never built a genome (e.g. a spawned worker)
+# can unpickle them, and the genomes it unpickles later share the same objects
+def restore_genome(cls, configuration, shared, letters, lengths, state):
+    shared = shared_configurations.setdefault(configuration, shared)
+    g = cls.__new__(cls)
+    g.__dict__.update(shared)
+    g.configuration = configuration
+    g.chromosomes = unpack_chromosomes(letters, lengths)
+    g.devices_index = [[] for chrom in g.chromosomes]
+    g.edit_log = []
+    g.alignement_memo = None
+    g.__dict__.update(state)
+    return g
+
 # Translate back a device from extracted to full sequence 
 
 def reinsert_device(device_listform):
-    return sum([(list(k))  for t in device_listform for k in t[::-1] if k is not None], [])
+    return encode_device(device_listform).tolist()
 
 # A device has a genetic mapping (mostly)
         
@@ -56,14 +86,9 @@ class device():
         else:  # for devices with a variable number of coding sections
             self.requirement =  [n_terms, n_parms]
             self.max_optional = [n_terms + optional[0], n_parms + optional[1]]
+    # returns a uint8 array (see device_codec)
     def generate_sequence(self, term_token, parm_token, sq_gen):
-        token_part= [*self.token,]
-        term_part = [[*sq_gen(), *term_token] for i in range(len(self.terms))]
-        parm_part = [[*sq_gen(), *parm_token] for i in range(len(self.parms))]
-        # print(token_part)
-        term_part = (sum(term_part, []))
-        parm_part = (sum(parm_part, []))
-        return token_part + term_part + parm_part
+        return encode_device(self.generate_tuples(term_token, parm_token, sq_gen))
     
     def generate_tuples(self, term_token, parm_token, sq_gen):
         return ([(self.token,None)]
@@ -101,6 +126,7 @@ class genome():
                     devices_generator = None, device_interaction_map = None, # genetic code
                     chrom_min_init = 5, chrom_max_init = 15, chrom_number_init = 4):   # genome size
 
+        check_alphabet(g_alphabet)
         self.ga = g_alphabet
 
         self.device_gen = devices_generator
@@ -116,11 +142,66 @@ class genome():
         self.max_term_size = 0
         self.devices_index = [[] * chrom_number_init]
 
+        # Edits of the chromosomes since the last build_devices (see log_edit), and the alignment scores of that build
+        self.edit_log = []
+        self.alignement_memo = None
+
+        self.share_configuration()
+
+    # --- Shared configuration, copy and pickling ------------------------------------------
+    # The configuration (alphabet, device generator, tokens ...) is never modified in place : genomes built with the
+    # same parameters point to the same objects (registered by configuration_key), which clones share.
+    # Pickles hold the chromosomes, the other per-genome attributes (e.g. DEAP's fitness) and the configuration, written
+    # once per pickle; the caches (devices_index, edit_log, alignement_memo) are rebuilt by the receiver.
+    shared_attributes = ('ga', 'device_gen', 'DIM', 'device_tokens', 'term_sequence_max_size', 'tk_size', 'token_collection')
+
+    # Subclasses set their own shared attributes after genome.__init__ : the ones not set yet are left out
+    def configuration_key(self):
+        gen = self.device_gen
+        # the generator and the token sets are described below, in a form that does not depend on iteration orders
+        described_apart = ('device_gen', 'device_tokens', 'token_collection')
+        description = (type(self).__qualname__, [(name, self.__dict__[name]) for name in self.shared_attributes if name in self.__dict__ and name not in described_apart],
+                       None if gen is None else (gen.term_token, gen.parm_token, gen.ssg.keywords,
+                                                 [(tk, d.requirement, d.max_optional) for tk, d in sorted(gen.devices_collection.items())]))
+        description = repr(description).encode() + repr((sorted(self.device_tokens), sorted(self.token_collection))).encode()
+        return hashlib.blake2b(description, digest_size = 16).hexdigest()
+
+    # To be called whenever a shared attribute is replaced
+    def share_configuration(self):
+        self.configuration = self.configuration_key()
+        shared = shared_configurations.setdefault(self.configuration, {name : self.__dict__[name] for name in self.shared_attributes if name in self.__dict__})
+        self.__dict__.update(shared)
+
+    def __deepcopy__(self, memo):
+        clone = type(self).__new__(type(self))
+        memo[id(self)] = clone
+        for name, value in self.__dict__.items():
+            if name in self.shared_attributes or name in ('configuration', 'alignement_memo'):  # the memo is replaced, never modified
+                clone.__dict__[name] = value
+            elif name == 'chromosomes':
+                clone.chromosomes = [chrom.copy() if isinstance(chrom, np.ndarray) else list(chrom) for chrom in value]
+            elif name == 'devices_index':
+                clone.devices_index = [list(index) for index in value]
+            elif name == 'edit_log':
+                clone.edit_log = list(value)
+            else:
+                clone.__dict__[name] = deepcopy(value, memo)
+        return clone
+
+    def __reduce__(self):
+        letters, lengths = pack_chromosomes(self.chromosomes)
+        state = {name : value for name, value in self.__dict__.items()
+                 if name not in self.shared_attributes and name not in ('chromosomes', 'devices_index', 'edit_log', 'alignement_memo', 'configuration')}
+        # the registry entry is the same object for all the genomes of a configuration : pickle's memo writes it once
+        shared = shared_configurations[self.configuration]
+        return (restore_genome, (type(self), self.configuration, shared, letters.tobytes(), lengths, state))
+
     # that one is going to be called a lot, so let's write it down properly
     def update(self):
         for k in range(len(self.chromosomes)-1, -1,  -1):
             if len(self.chromosomes[k]) == 0:
                 del self.chromosomes[k]
+                self.edit_log.append(('del_chrom', k))
 
         if len(self.devices_index) != len(self.chromosomes):
             self.devices_index = [[]] * len(self.chromosomes)
@@ -133,23 +214,40 @@ class genome():
         return f'{[len(chrom) for chrom in self.chromosomes]}'
         # return ','.join([str(np.array(chrom)) for chrom in self.chromosomes])
 
+    # the token scanner of extract_devices is rebuilt lazily for the new token collection
+    # The token sets are shared with other genomes, so they are replaced rather than modified
     def add_device_token(self, new_token):
-            self.device_tokens |= set((new_token,)) 
-            self.token_collection |= set((new_token,)) 
+            self.device_tokens = self.device_tokens | set((new_token,)) 
+            self.token_collection = self.token_collection | set((new_token,)) 
+            self.share_configuration()
 
     # Returns the complementary to a sequence
     # aka the sequence silencing the interaction
+    # returns an array (complement_sequences does it for a list of sequences at once)
     def complement_sequence(self, sq):
-        half_alphabet_size = int(len(genetic_alphabet)/2)
         try:
-            sq_comp = [self.ga[(char) - half_alphabet_size] for char in sq]
+            return transform(complement_table(self.ga), sq)
         except:
             print(sq)
             raise
-        return sq_comp
+
+    def complement_sequences(self, sequences):
+        return transform_batch(complement_table(self.ga), sequences)
 
     # === Manage Mutations ================================================================================================
 
+    # --- Edit log ---------------------------------------------------------------------
+    # Every mutation records what it did to the chromosomes, in order, with the coordinates of the time of the edit :
+    # ('edit', k, start, removed, inserted) : chromosomes[k][start:start + removed] was replaced by inserted letters
+    # ('del_chrom', k)                       : chromosome k was deleted
+    # ('new_chrom', k)                       : a chromosome was inserted at index k
+    # It has to be called before the edit, as the slice [start:stop) is clipped to the current chromosome
+    def log_edit(self, k, start, stop, inserted):
+        length = len(self.chromosomes[k])
+        start = min(int(start), length)
+        stop = min(max(int(stop), start), length)
+        self.edit_log.append(('edit', int(k), start, stop - start, int(inserted)))
+
     # --- Single Nucleotide ------------------------------------------------------------
     # as noted in the thesis (p. 113 note 15), it is more efficient to roll for amount of mutations -> position of mutations rather than 'is there mutation' for each nucleotide
 
@@ -162,6 +260,7 @@ class genome():
         for k in range(len(self.chromosomes)):
             if places_to_insert[k] is not None:
                 for place in places_to_insert[k]:
+                    self.log_edit(k, place, place, 1)
                     self.chromosomes[k].insert(place, random_letter())
         self.update()
 
@@ -179,6 +278,7 @@ class genome():
         for k in range(len(self.chromosomes)):
             if places_to_del[k] is not None:
                 for place in places_to_del[k]:
+                    self.log_edit(k, place, place + 1, 0)
                     self.chromosomes[k].pop(place)
 
         self.update()
@@ -194,6 +294,7 @@ class genome():
             if places_to_sub[k] is not None:
                 for place in places_to_sub[k]:
                     try:
+                        self.log_edit(k, place, place + 1, 1)
                         self.chromosomes[k][place] = random_letter()
                     except TypeError:
                         print(list(self.chromosomes[k]))
@@ -218,13 +319,16 @@ class genome():
         for k in range(len(self.chromosomes)):
             if (places_to_sub[k]) is not None:
                 for place in places_to_sub[k]:
+                    self.log_edit(k, place, place, 1)
                     self.chromosomes[k].insert(place, random_letter())
             if (places_to_ins[k]) is not None:
                 for place in places_to_ins[k]:
+                    self.log_edit(k, place, place, 1)
                     self.chromosomes[k].insert(place, random_letter())
                     places_to_ins[k][places_to_ins[k] > place] += 1
             if (places_to_del[k]) is not None:
                 for place in places_to_del[k]:
+                    self.log_edit(k, place, place + 1, 0)
                     self.chromosomes[k].pop(place)
         self.update()
 
@@ -272,6 +376,7 @@ class genome():
         # operations are considered as sequential and not simultaneous (if p_f2 is not too high there should be little to no overlap anyway)
         for i, new_frag in enumerate(fragments_strings):
             where_to_insert = rng.integers(1, len(self.chromosomes[chrom_to_go[i]]) - 1)
+            self.log_edit(chrom_to_go[i], where_to_insert, where_to_insert, len(new_frag))
             self.chromosomes[chrom_to_go[i]][where_to_insert:where_to_insert] = list(new_frag)
 
         self.update()
@@ -280,8 +385,8 @@ class genome():
         whether_to_change = rng.choice([0, 1],p = [1-p_fc, p_fc], size = len(self.chromosomes)) #number of chr is low so we draw for each
         # choose slices from each chromosome
         fragments = self.choose_fragments(whether_to_change)
-        # pick them up
-        fragments_strings = ([self.chromosomes[k][start:end]  for k, chr_f in enumerate(fragments) for start, end in chr_f])
+        # pick them up, complemented all at once
+        fragments_strings = self.complement_sequences([self.chromosomes[k][start:end]  for k, chr_f in enumerate(fragments) for start, end in chr_f])
         # assign them to random locations on random chromosomes   (doing those draws separately)
         if len(self.chromosomes) == 1:
             chrom_to_go = np.zeros(len(fragments_strings), dtype = int)
@@ -290,7 +395,8 @@ class genome():
         # operations are considered as sequential and not simultaneous (if p_f2 is not too high there should be little to no overlap anyway)
         for i, new_frag in enumerate(fragments_strings):
             where_to_insert = rng.integers(1, len(self.chromosomes[chrom_to_go[i]]) - 1)
-            self.chromosomes[chrom_to_go[i]][where_to_insert:where_to_insert] = list(self.complement_sequence(new_frag))
+            self.log_edit(chrom_to_go[i], where_to_insert, where_to_insert, len(new_frag))
+            self.chromosomes[chrom_to_go[i]][where_to_insert:where_to_insert] = new_frag.tolist()
 
         self.update()
 
@@ -307,11 +413,13 @@ class genome():
             chrom_to_go = rng.integers(0, len(self.chromosomes) - 1, len(fragments_strings))
         # deletion first, insertion second
         for k, frags in enumerate(fragments):
-            for f in frags[::-1]:  # going through backwards so we don't modify list index 
+            for f in frags[::-1]:  # going through backwards so we don't modify list index 
+                self.log_edit(k, *f, 0)
                 self.chromosomes[k][slice(*f)] = []
 
         for i, new_frag in enumerate(fragments_strings):
             where_to_insert = rng.integers(1, len(self.chromosomes[chrom_to_go[i]]) - 1)
+            self.log_edit(chrom_to_go[i], where_to_insert, where_to_insert, len(new_frag))
             self.chromosomes[chrom_to_go[i]][where_to_insert:where_to_insert] = list(new_frag)
 
         self.update()
@@ -321,7 +429,8 @@ class genome():
         # choose slices from each chromosome
         fragments = self.choose_fragments(whether_to_change)
         for k, frags in enumerate(fragments):
-            for f in frags[::-1]:  # going through backwards so we don't modify list index 
+            for f in frags[::-1]:  # going through backwards so we don't modify list index 
+                self.log_edit(k, *f, 0)
                 self.chromosomes[k][slice(*f)] = []
         self.update()
 
@@ -341,7 +450,8 @@ class genome():
                     else:
                         print(len(self.chromosomes[k]))
                         raise
-                self.chromosomes[k][where_to_insert:where_to_insert] = list(new_device)
+                self.log_edit(k, where_to_insert, where_to_insert, len(new_device))
+                self.chromosomes[k][where_to_insert:where_to_insert] = new_device.tolist()
         self.update()
 
     # --- Chromosome - level mutations -----------------------------------------------------------
@@ -352,8 +462,10 @@ class genome():
             if whether_to_change[k,0]:
                 # print('duplicated !')
                 if whether_to_change[k,1]:  # appends
+                    self.log_edit(k, len(self.chromosomes[k]), len(self.chromosomes[k]), len(self.chromosomes[k]))
                     self.chromosomes[k][len(self.chromosomes[k]):] = deepcopy(self.chromosomes[k])
                 else:    # creates new chrom
+                    self.edit_log.append(('new_chrom', len(self.chromosomes)))
                     self.chromosomes.append(deepcopy(self.chromosomes[k]))
                     self.devices_index += []
         self.update()
@@ -361,14 +473,29 @@ class genome():
         whether_to_change = rng.choice([0, 1],p = [1-p_cd, p_cd], size = len(self.chromosomes))
         for k in range(len(self.chromosomes))[::-1]:
             if whether_to_change[k]:
+                    self.edit_log.append(('del_chrom', k))
                     self.chromosomes.pop(k)
                     del self.devices_index[-1]
         self.update()
-    # has to be random rolled at the population level
-    # TODO when local/global scoring is handled, as it heavly depends upon it
+    # has to be random rolled at the population level (see population_chrom_cross)
+    # Exchanges a segment of a random chromosome with a segment of a random chromosome of other_genome
+    # Segment lengths are geometric with mean lm; only the segments are copied, they are spliced in place
     def chrom_cross(self, other_genome, lm = 20):
-        pass
+        if len(self.chromosomes) == 0 or len(other_genome.chromosomes) == 0:
+            return
+        ka = rng.integers(0, len(self.chromosomes))
+        kb = rng.integers(0, len(other_genome.chromosomes))
+        a, b = self.chromosomes[ka], other_genome.chromosomes[kb]
+        la, lb = np.minimum(rng.geometric(1/lm, size = 2), [len(a), len(b)])
+        sa = rng.integers(0, len(a) - la + 1)
+        sb = rng.integers(0, len(b) - lb + 1)
+        segment_a, segment_b = a[sa:sa + la], b[sb:sb + lb]
+        self.log_edit(ka, sa, sa + la, lb)
+        other_genome.log_edit(kb, sb, sb + lb, la)
+        self.chromosomes[ka] = splice(a, sa, sa + la, segment_b)
+        other_genome.chromosomes[kb] = splice(b, sb, sb + lb, segment_a)
         self.update()
+        other_genome.update()
 
     # --- Genome - level mutations  ----------------------------------------------------------
 
@@ -376,41 +503,61 @@ class genome():
         if rng.random() < p_g2:
             append_if_false = rng.choice([0, 1], size = len(self.chromosomes))
             if append_if_false.all():
+                self.edit_log += [('new_chrom', len(self.chromosomes) + k) for k in range(len(self.chromosomes))]
                 self.chromosomes[len(self.chromosomes):] = deepcopy(self.chromosomes)
             else:
                 for k, aif in enumerate(append_if_false):
                     if aif:
+                        self.edit_log.append(('new_chrom', len(self.chromosomes)))
                         self.chromosomes[len(self.chromosomes):] = deepcopy([self.chromosomes[k]])
                         self.devices_index += []
                     else:
+                        self.log_edit(k, len(self.chromosomes[k]), len(self.chromosomes[k]), len(self.chromosomes[k]))
                         self.chromosomes[k][len(self.chromosomes[k]):] = deepcopy(self.chromosomes[k])
 
         self.update()
 
     # Relies on genome decoding and device extraction
-    # TODO when device extraction has been managed
+    # Deletes the non-coding regions, except for term_sequence_max_size letters of padding on both sides of each device
+    # Chromosomes without any device are deleted, genomes without any device are left untouched
     def genome_trim(self, p_gt = .001):
-    # TODO : finsh
+        if rng.random() >= p_gt:
+            return
+
         # --- Detect coding indexes        
-        # Handled by self.extract_devices
-        
+        # devices_index is only valid right after self.extract_devices, and the previous mutations may have moved devices
+        for k in range(len(self.chromosomes)):
+            self.extract_devices(k)
+        if sum([len(index) for index in self.devices_index]) == 0:
+            return
+
         # --- Delete noncoding indexes
-        # Padding --> one coding sequence ?
         for k, chrom in enumerate(self.chromosomes):
-            local_devices_index = np.array(self.devices_index[k])
-            # Add padding
-            local_devices_index[::2] -= self.term_sequence_max_size
-            local_devices_index[1::2]+= self.term_sequence_max_size
-            local_devices_index = np.clip(local_devices_index, 0, len(chrom)-1)
-            for j in range(0, len(self.devices_index[k]), -2):
-                if j == 0:
-                    del (chrom[0:self.devices_index[k][j]])
-                else:
-                    del (chrom[self.devices_index[k][j-1]:self.devices_index[k][j]])
-
+            keep = self.coding_mask(len(chrom), self.devices_index[k], self.term_sequence_max_size)
+            # deleted ranges, from the last one so that the logged coordinates stay valid
+            switches = np.flatnonzero(np.diff(np.concatenate(([True], keep, [True])).astype(int)))
+            for start, stop in switches.reshape((-1, 2))[::-1]:
+                self.log_edit(k, start, stop, 0)
+            if isinstance(chrom, np.ndarray):
+                self.chromosomes[k] = chrom[keep]
+            else:
+                self.chromosomes[k] = list(compress(chrom, keep))
+            self.devices_index[k] = []
 
         self.update()
 
+    # Boolean mask of the letters covered by the [start, end) device ranges of devices_index (flat, as built by extract_devices), 
+    # extended by padding on both sides
+    def coding_mask(self, length, devices_index, padding = 0):
+        index = np.array(devices_index, dtype = int).reshape((-1, 2))
+        starts = np.clip(index[:, 0] - padding, 0, length)
+        ends = np.clip(index[:, 1] + padding, 0, length)
+        # +1 when entering a range, -1 when leaving it : covered letters have a positive running sum
+        delta = np.zeros(length + 1, dtype = int)
+        np.add.at(delta, starts, 1)
+        np.add.at(delta, ends, -1)
+        return np.cumsum(delta[:-1]) > 0
+
 
 
 
@@ -425,11 +572,17 @@ class genome():
         assert len(mutate_funcs) == len(p_array), f'{len(mutate_funcs)} != {len(p_array)}'
         if len(self.chromosomes) == 0:
             return None
+        # the log is only needed to reuse the scores of the last build
+        if self.alignement_memo is None:
+            self.edit_log = []
         
         for k in range(len(self.chromosomes)):
             assert len(self.chromosomes[k]) > 0
 
         for i, f in enumerate(mutate_funcs):  #[::-1] have genome_trim first so device_index is still valid
+            # pairs of genomes are rolled at the population level, by population_chrom_cross
+            if f == self.chrom_cross:
+                continue
             # print(f.__name__, p_array[i])
             f(p_array[i])
             # print(f.__name__, f(p_array[i]))  
@@ -457,19 +610,22 @@ class genome():
         
 
 
-        for i in range(0, len(c)-self.tk_size+1):
+        # only the windows holding a token can change the extraction state, they are all found in one pass
+        for i, tk in get_scanner(self.token_collection, len(self.ga)).scan(c):
             # we were extracting a device, but it is invalid (too long)
             if in_device and i > max_index_for_current_conding_sequence:
                 in_device = False
                 devices.pop(-1)
+                self.devices_index[k_chr].pop(-1)
                 # max_last_device_index = len(c)     # should not be necessary
 
             # we found a new device
-            if tuple(c[i:i+self.tk_size]) in self.device_tokens:
+            if tk in self.device_tokens:
                 # it means that our last, unfinished device has to be considered invalid before starting the new one
                 if in_device: 
                     # current device is invalid
                     devices.pop(-1)
+                    self.devices_index[k_chr].pop(-1)
                 # but we found a new one
 
                 # print(f'new device token @ {i}')
@@ -485,7 +641,7 @@ class genome():
 
 
             # we found a term/parm token while building a device (as all tokens in token_collection are either term, parm or device)
-            elif in_device and c[i:i+self.tk_size] in self.token_collection:
+            elif in_device:
 
                 # it is a term token
                 if self.device_gen.term_token == c[i:i+self.tk_size]:
@@ -533,9 +689,10 @@ class genome():
 
                 last_tk_end = i + self.tk_size
         # Last device found was invalid and not catched :
-        # - there was at least one device found (current is not None)
-        # - last device found was invalid (current != required)
-        # - last device was not catched (not in_device)
+        # - there was at least one device found (current is not None)
+        # - last device found was invalid (current != required)
+        # - last device was not catched (not in_device)
+        # (this includes a last device that ran out of coding sequence after the last token)
         if ([(current_terms), (current_parms)] != [None, None]) and (in_device and  ([len(current_terms), len(current_parms)] != required)):
             devices.pop(-1)
             self.devices_index[k_chr].pop(-1)
@@ -548,110 +705,88 @@ class genome():
 
         return devices
 
-    def generic_build_devices(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
+    # sparse = True returns scipy.sparse CSR adjacency matrices (one per network) instead of dense arrays
+    def generic_build_devices(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, sparse = False):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
         n_networks = np.unique(TAM[TAM != 0]).shape[0]
         if n_networks == 1:
-            return self.generic_build_devices_1(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list)
+            return self.generic_build_devices_1(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, sparse)
         elif n_networks > 1:
-            return self.generic_build_devices_2(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list)
+            return self.generic_build_devices_2(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, sparse)
 
 
 
-    def generic_build_devices_1(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
+    def generic_build_devices_1(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, sparse = False):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
         # Network adjacency matrix
         if hasattr(self, 'fixed_sequences'):
-            NAM = np.zeros((len(all_devs) + self.n_fixed, len(all_devs) + self.n_fixed))  # interactions for all devices + fixed sequences 
+            n_nodes = len(all_devs) + self.n_fixed  # interactions for all devices + fixed sequences 
         else:
-            NAM = np.zeros((len(all_devs), len(all_devs)))  # interactions for all devices --> size = n_devices**2
-        # Node properties
-        NP = [[d[0][0]] + [None]*DD[d[0][0]][2] for d in (all_devs)] # properties for all devices --> size = n_devices * nprops/device (= 1 for device name + npars)
-        # Parsing, splitting terms and pars while keeping track of the device ID
-        term_lists = [[]] * len(TAM)
-        term_IDs = [[]] * len(TAM)
-        par_lists = [[]] * sum([value[2] for value in DD.values()])
-        par_IDs = [[]] * sum([value[2] for value in DD.values()])
-        for devname, dev in enumerate(all_devs):
-            dtype = dev[0][0]
-            specs = DD[dtype]
-            dev_terms = [s[1] for s in dev if s[0] == self.device_gen.term_token]
-            dev_pars = [s[1] for s in dev if s[0] == self.device_gen.parm_token]
-            for i, term_sq in enumerate(dev_terms):
-                term_indice = specs[0] + i
-                term_lists[term_indice] += [term_sq]
-                term_IDs[term_indice] += [devname]
-            for i, par_sq in enumerate(dev_pars):
-                par_indice = specs[0] + specs[1] + i
-                par_lists[par_indice] += [par_sq]
-                par_IDs[par_indice] += [devname]
-
-        # adding fixed sequences
-
-        # compute interactions - V1
-        for i in range(len(TAM)):
-            for j in range(len(TAM)):
-                if TAM[i][j]:
-                    interaction = terminal_interaction(term_lists[i], term_lists[j])
-                    for inter in interaction:
-                        if inter != np.nan:
-                            NAM[term_IDs[i]][term_IDs[j]] += inter
-                    
-        # Compute parameters
-        for i, par_list in enumerate(par_lists):
-            par_values = parameter_evaluation_list[i](par_list)
-            for j, par in enumerate(par_values):
-                NP[par_IDs[i][j]][i+1] = par
-
-        return NAM, NP
-
-    def generic_build_devices_2(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
+            n_nodes = len(all_devs)  # interactions for all devices --> size = n_devices**2
+        # every TAM block feeds the same (single) network
+        layers = np.zeros(np.shape(TAM), dtype = int)
+        NAMs, NP = self.generic_build_devices_n(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, 
+                                                layers, 1, n_nodes, sparse)
+        return NAMs[0], NP
+
+    def generic_build_devices_2(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, sparse = False):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
+        # one network per distinct non-zero TAM value
         networks = np.unique(TAM[TAM != 0])
-        NAMs = np.zeros((len(networks), len(all_devs), len(all_devs)))
+        layers = np.searchsorted(networks, TAM)
+        return self.generic_build_devices_n(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, 
+                                            layers, len(networks), sparse = sparse)
+
+    def generic_build_devices_3(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, sparse = False):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
+        # block (i, j) feeds network i + j
+        layers = np.add.outer(np.arange(len(TAM)), np.arange(len(TAM)))
+        return self.generic_build_devices_n(all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, 
+                                            layers, TAM.sum(), sparse = sparse)
+
+    # Shared implementation of the generic_build_devices variants
+    # layers[i, j] is the network (first axis of the returned NAMs) fed by the TAM block (i, j)
+    # terminal_interaction(terms_i, terms_j) is called once per non-zero TAM block and has to return 
+    # the (len(terms_i), len(terms_j)) interaction matrix of the block, np.nan meaning no interaction
+    # With sparse = True, NAMs is a list of n_layers CSR matrices and the dense tensor is never allocated
+    def generic_build_devices_n(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list, layers, n_layers, n_nodes = None, sparse = False):
+        if n_nodes is None:
+            n_nodes = len(all_devs)
+        if sparse:
+            # (rows, cols, values) triplets for each layer
+            entries = [[] for l in range(n_layers)]
+        else:
+            NAMs = np.zeros((n_layers, n_nodes, n_nodes))
         # Node properties
-        NP = [[d[0][0]] + [None]*DD[d[0][0]][2] for d in (all_devs)] # properties for all devices --> size = n_devices * nprops/device (= 1 for device name + npars)
-        # Parsing, splitting terms and pars while keeping track of the device ID
-        term_lists = [[]] * len(TAM)
-        term_IDs = [[]] * len(TAM)
-        par_lists = [[]] * sum([value[2] for value in DD.values()])
-        par_IDs = [[]] * sum([value[2] for value in DD.values()])
-        for devname, dev in enumerate(all_devs):
-            dtype = dev[0][0]
-            specs = DD[dtype]
-            dev_terms = [s[1] for s in dev if s[0] == self.device_gen.term_token]
-            dev_pars = [s[1] for s in dev if s[0] == self.device_gen.parm_token]
-            for i, term_sq in enumerate(dev_terms):
-                term_indice = specs[0] + i
-                term_lists[term_indice] += [term_sq]
-                term_IDs[term_indice] += [devname]
-            for i, par_sq in enumerate(dev_pars):
-                par_indice = specs[0] + specs[1] + i
-                par_lists[par_indice] += [par_sq]
-                par_IDs[par_indice] += [devname]
+        NP = [[d[0][0]] + [None]*DD[d[0][0]][2] for d in (all_devs)] # properties for all devices --> size = n_devices * nprops/device (= 1 for device name + npars)
+        term_lists, term_IDs, par_lists, par_IDs = self.parse_terms_and_parms(all_devs, TAM, DD)
+
         # Compute parameters
         for i, par_list in enumerate(par_lists):
             par_values = parameter_evaluation_list[i](par_list)
             for j, par in enumerate(par_values):
                 NP[par_IDs[i][j]][i+1] = par
 
-        # compute interactions - V1
-        for i in range(len(TAM)):
-            for j in range(len(TAM)):
-                if TAM[i][j] != 0:
-                    interaction = terminal_interaction(term_lists[i], term_lists[j])
-                    for inter in interaction:
-                        if inter != np.nan:
-                            NAMs[networks == TAM[i][j]][:, term_IDs[i], term_IDs[j]] += inter
+        # compute interactions - V2 : one call per TAM block, scattered all at once in the adjacency tensor
+        for i, j in np.argwhere(TAM != 0):
+            if len(term_IDs[i]) == 0 or len(term_IDs[j]) == 0:
+                continue
+            interaction = self.block_interaction(terminal_interaction, term_lists[i], term_lists[j])
+            if sparse:
+                rows, cols = np.broadcast_arrays(term_IDs[i][:, None], term_IDs[j][None, :])
+                entries[layers[i, j]].append((rows.ravel(), cols.ravel(), interaction.ravel()))
+            else:
+                # np.add.at accumulates repeated (device, device) pairs instead of keeping only the last one
+                np.add.at(NAMs, (layers[i, j], term_IDs[i][:, None], term_IDs[j][None, :]), interaction)
+
+        if sparse:
+            NAMs = [sparse_layer(layer_entries, n_nodes) for layer_entries in entries]
 
         return NAMs, NP
 
-    def generic_build_devices_3(self, all_devs, TAM, DD, terminal_interaction, parameter_evaluation_list):   # DD = {'device_token' : [sum_of_nter_and_npar_for_previous_devices, n_terms, n_pars]}
-        NAMs = np.zeros((TAM.sum(), len(all_devs), len(all_devs)))
-        # Node properties
-        NP = [[d[0][0]] + [None]*DD[d[0][0]][2] for d in (all_devs)] # properties for all devices --> size = n_devices * nprops/device (= 1 for device name + npars)
-        # Parsing, splitting terms and pars while keeping track of the device ID
-        term_lists = [[]] * len(TAM)
-        term_IDs = [[]] * len(TAM)
-        par_lists = [[]] * sum([value[2] for value in DD.values()])
-        par_IDs = [[]] * sum([value[2] for value in DD.values()])
+    # Parsing, splitting terms and pars while keeping track of the device ID
+    def parse_terms_and_parms(self, all_devs, TAM, DD):
+        term_lists = [[] for i in range(len(TAM))]
+        term_IDs = [[] for i in range(len(TAM))]
+        n_pars = sum([value[2] for value in DD.values()])
+        par_lists = [[] for i in range(n_pars)]
+        par_IDs = [[] for i in range(n_pars)]
         for devname, dev in enumerate(all_devs):
             dtype = dev[0][0]
             specs = DD[dtype]
@@ -659,28 +794,74 @@ class genome():
             dev_pars = [s[1] for s in dev if s[0] == self.device_gen.parm_token]
             for i, term_sq in enumerate(dev_terms):
                 term_indice = specs[0] + i
-                term_lists[term_indice] += [term_sq]
-                term_IDs[term_indice] += [devname]
+                term_lists[term_indice].append(term_sq)
+                term_IDs[term_indice].append(devname)
             for i, par_sq in enumerate(dev_pars):
                 par_indice = specs[0] + specs[1] + i
-                par_lists[par_indice] += [par_sq]
-                par_IDs[par_indice] += [devname]
-        # Compute parameters
-        for i, par_list in enumerate(par_lists):
-            par_values = parameter_evaluation_list[i](par_list)
-            for j, par in enumerate(par_values):
-                NP[par_IDs[i][j]][i+1] = par
-
-        # compute interactions - V1
-        for i in range(len(TAM)):
-            for j in range(len(TAM)):
-                if TAM[i][j]:
-                    interaction = terminal_interaction(term_lists[i], term_lists[j])
-                    for inter in interaction:
-                        if inter != np.nan:
-                            NAMs[i+j][term_IDs[i]][term_IDs[j]] += inter
-
-        return NAMs, NP
+                par_lists[par_indice].append(par_sq)
+                par_IDs[par_indice].append(devname)
+
+        term_IDs = [np.array(IDs, dtype = int) for IDs in term_IDs]
+        return term_lists, term_IDs, par_lists, par_IDs
+
+    # Interaction matrix of a whole TAM block, with non-interacting pairs (nan) counting as 0
+    def block_interaction(self, terminal_interaction, terms_1, terms_2):
+        interaction = np.array(terminal_interaction(terms_1, terms_2), dtype = float).reshape((len(terms_1), len(terms_2)))
+        interaction[np.isnan(interaction)] = 0.0
+        return interaction
+
+# Assembles (rows, cols, values) triplets into a CSR adjacency matrix; duplicated pairs are summed
+def sparse_layer(layer_entries, n_nodes):
+    if len(layer_entries) == 0:
+        return sp.csr_matrix((n_nodes, n_nodes))
+    rows, cols, values = (np.concatenate(e) for e in zip(*layer_entries))
+    layer = sp.coo_matrix((values, (rows, cols)), shape = (n_nodes, n_nodes)).tocsr()
+    layer.eliminate_zeros()
+    return layer
+
+# Follows device spans (k, start, end) through an edit log (see genome.log_edit)
+# Returns {(k, start) : (new_k, new_start)} for the devices whose letters were left untouched
+def move_spans(spans, edit_log):
+    moved = {}
+    for k0, s0, e0 in spans:
+        k, s, e = k0, s0, e0
+        for entry in edit_log:
+            if entry[0] == 'edit':
+                kk, start, removed, inserted = entry[1:]
+                if kk != k or start >= e:
+                    continue
+                # edit strictly before the device : it is shifted
+                if start + removed <= s:
+                    s += inserted - removed
+                    e += inserted - removed
+                else:
+                    break
+            elif entry[0] == 'del_chrom':
+                if entry[1] == k:
+                    break
+                elif entry[1] < k:
+                    k -= 1
+            elif entry[0] == 'new_chrom' and entry[1] <= k:
+                k += 1
+        else:
+            moved[(k0, s0)] = (k, s)
+    return moved
+
+# Population-level chromosome crossover, in one call
+# Each genome takes part with probability p_cc (standard_mutate_rate[10]), the selected genomes are paired at random
+# (the odd one out, if any, is left unchanged). Returns the pairs of indices that were crossed.
+def population_chrom_cross(population, p_cc = .1, lm = 20):
+    selected = np.flatnonzero(rng.random(len(population)) < p_cc)
+    rng.shuffle(selected)
+    pairs = selected[:2*(len(selected)//2)].reshape((-1, 2))
+    for i, j in pairs:
+        population[i].chrom_cross(population[j], lm)
+    return pairs
+
+# Steady-state counterpart of population_chrom_cross : with probability p_cc, g exchanges segments with mate
+def pair_chrom_cross(g, mate, p_cc = .1, lm = 20):
+    if rng.random() < p_cc:
+        g.chrom_cross(mate, lm)
 
 neuron_exct_device = device(neup_token, 2, 0)
 neuron_inhi_device = device(neum_token, 2, 0)
@@ -691,6 +872,8 @@ acrobot_devices = devices_generator([neuron_exct_device, neuron_inhi_device, seg
 
 
 class acrobot_genome(genome):
+    shared_attributes = genome.shared_attributes + ('pivot_sq',)
+
     def __init__(self, segment_init = 2, sensor_init = 1, neuron_init = 'dense', **kwargs):
         super().__init__(devices_generator = acrobot_devices, 
                        chrom_min_init = 0, chrom_max_init = 0, chrom_number_init = 0,
@@ -703,6 +886,7 @@ class acrobot_genome(genome):
             print(locals())
             raise    
         self.pivot_sq = [0, 0, 0]   # discuss changes
+        self.share_configuration()
 
         if neuron_init == 'dense':
             network = []
@@ -715,17 +899,30 @@ class acrobot_genome(genome):
             # for i in range(n_in):
             #     network.append([('NEUP', None), ('TERM', variate_sequence(segments[i][2][1])), ('TERM', self.device_gen.ssg())])
 
-        segment_sequences = [reinsert_device(s) for s in segments]
-        network_sequences = [reinsert_device(s) for s in network]
-
-        to_be_inserted = segment_sequences + network_sequences
+        to_be_inserted = segments + network
         rng.shuffle(to_be_inserted)
 
-        thing = np.concatenate([np.concatenate((t,random_sequence(5))) for t in to_be_inserted])
-        self.chromosomes = [list(np.concatenate((random_sequence(5), thing)))]
+        # each device is followed by a random non-coding sequence, and the chromosome starts with one
+        gaps = [random_sequence(5) for t in to_be_inserted]
+        gaps.insert(0, random_sequence(5))
+        self.chromosomes = [encode_layout(to_be_inserted, gaps).tolist()]
 
 
-    # reference for f(score_alignement) = edge_weight
+    # (k, start, end) of the devices of the last extract_devices on every chromosome, in the order of all_devs
+    def device_spans(self):
+        return [(k, index[j], index[j+1]) for k, index in enumerate(self.devices_index) for j in range(0, len(index) - 1, 2)]
+
+    # Alignment scores of the last build_devices, for the devices left untouched by the mutations since then
+    # keys are (position, term, position, term), positions being the (k, start) of devices in the current chromosomes
+    def inherited_scores(self):
+        if self.alignement_memo is None:
+            return {}
+        spans, scores = self.alignement_memo
+        moved = move_spans(spans, self.edit_log)
+        moved[None] = None  # the pivot sequence
+        return {(moved[a], ta, moved[b], tb) : score for (a, ta, b, tb), score in scores.items() if a in moved and b in moved}
+
+    # reference for f(score_alignement) = edge_weight
     # weights in [0; 1]
     # score is an array of floats
     def alignement_to_weight(self, score, lowclip = 5.0, highclip = 30.0, type = 'linear'):
@@ -746,6 +943,27 @@ class acrobot_genome(genome):
         # start with building the body
         # reference string for anchor : self.pivot_sq 
         
+        # Only the terms of devices changed since the last build are aligned, the other scores are reused
+        spans = self.device_spans()
+        if len(spans) != len(all_devs):   # all_devs does not come from the last extract_devices
+            spans = None
+        inherited = self.inherited_scores() if spans is not None else {}
+        positions = None if spans is None else [(k, start) for k, start, end in spans]
+        scores = {}
+        # score of the alignement of term ta of device a with term tb of device b (b = None for the pivot sequence)
+        def term_score(a, ta, b = None, tb = None):
+            if positions is None:
+                key = None
+            else:
+                key = (positions[a], ta, None if b is None else positions[b], tb)
+                if key in inherited:
+                    scores[key] = inherited[key]
+                    return scores[key]
+            score = score_alignement(all_devs[a][ta][1], self.pivot_sq if b is None else all_devs[b][tb][1])[1]
+            if key is not None:
+                scores[key] = score
+            return score
+
         all_devs = np.array(all_devs, dtype = list)
         device_type = np.array([(dev[0][0]) for dev in all_devs])
         stik_mask = (device_type == stik_token).all(axis = 1)
@@ -762,11 +980,12 @@ class acrobot_genome(genome):
             return np.array([[]]), []
 
         # print(t_useful_interactions)
+        stik_index = np.flatnonzero(stik_mask)
         body = [[],]*stik_mask.sum()
         available_for_placement = list(range(stik_mask.sum()))
         # Building the body
         # - first segment
-        score_with_pivot = [score_alignement(dev[1][1], self.pivot_sq)[1] for dev in all_devs[stik_mask]]
+        score_with_pivot = [term_score(i, 1) for i in stik_index]
         try:
             body[0] = int(np.argmax(score_with_pivot))
         except:
@@ -774,7 +993,7 @@ class acrobot_genome(genome):
             raise
         available_for_placement.pop(body[0])
         for k in range(len(body)-1):
-            interactions_to_consider = [score_alignement(dev[1][1], all_devs[stik_mask][body[k]][2][1])[1] for dev in all_devs[stik_mask][available_for_placement]]
+            interactions_to_consider = [term_score(i, 1, stik_index[body[k]], 2) for i in stik_index[available_for_placement]]
             #[t_interaction[i,body[k]] for i in available_for_placement]
             winning_term_arg = np.argmax(interactions_to_consider)
             body[k+1] = copy(available_for_placement[winning_term_arg])
@@ -783,8 +1002,10 @@ class acrobot_genome(genome):
        
         # network_ins/out = body
         devs_from_body_ordered = np.array(all_devs, dtype = object)[stik_mask][body]
+        body_index = stik_index[body]
 
         network_hidden_mask = np.logical_or((device_type == neup_token).all(axis = 1), (device_type == neum_token).all(axis = 1))
+        hidden_index = np.flatnonzero(network_hidden_mask)
         
 
 
@@ -793,20 +1014,25 @@ class acrobot_genome(genome):
 
                     # Input - Hidden
         
-        edges_in_hid = [[score_alignement(dev[1][1], Input[3][1])[1] for Input in devs_from_body_ordered] 
-                     for dev in np.array(all_devs, dtype = object)[network_hidden_mask]]
+        edges_in_hid = [[term_score(dev, 1, Input, 3) for Input in body_index] 
+                     for dev in hidden_index]
 
                      # Input - Ouput
-        edges_in_out = [[score_alignement(dev[1][1], Input[3][1])[1] for Input in devs_from_body_ordered] 
-                     for dev in devs_from_body_ordered[:-1]]
+        edges_in_out = [[term_score(dev, 1, Input, 3) for Input in body_index] 
+                     for dev in body_index[:-1]]
 
-                     # Hidden - Output
-        edges_hid_out = [[score_alignement(Output[1][1], dev[2][1])[1] for dev in np.array(all_devs, dtype = object)[network_hidden_mask]] 
-                     for Output in devs_from_body_ordered[:-1]]   # reorder as body and exclude last
+                     # Hidden - Output
+        edges_hid_out = [[term_score(Output, 1, dev, 2) for dev in hidden_index] 
+                     for Output in body_index[:-1]]   # reorder as body and exclude last
 
                      # Hidden - Hidden
-        edges_hid_hid = [[score_alignement(dev_1[1][1], dev_2[2][1])[1] for dev_2 in np.array(all_devs, dtype = object)[network_hidden_mask] ]
-                       for dev_1 in np.array(all_devs, dtype = object)[network_hidden_mask]]
+        edges_hid_hid = [[term_score(dev_1, 1, dev_2, 2) for dev_2 in hidden_index]
+                       for dev_1 in hidden_index]
+
+        # the scores of this build are inherited by the mutated copies of this genome
+        if spans is not None:
+            self.alignement_memo = (spans, scores)
+            self.edit_log = []
         
 
 
@@ -855,6 +1081,38 @@ class acrobot_genome(genome):
 
 
 
+# Builds the ANN encoded by build_devices
+# net_AM[r, c] is the weight of the edge from node c (inputs, then hidden) to node n_in + r (hidden, then outputs)
+# net_AM can be a dense array or a scipy.sparse matrix, only its non-zero entries are visited
+def build_net(net_AM, net_struct, default_activation = 'tanh'):
+    net = ann.ANN(default_activation = default_activation)
+    for node in net_struct:
+        # NEUM devices are inhibitor neurons
+        net.add_node(1, IN = node == 'IN', OUT = node == 'OUT', activation = 'negative_tanh' if node == 'NEUM' else None)
+
+    n_in = net_struct.count('IN')
+    if sp.issparse(net_AM):
+        net_AM = net_AM.tocoo()
+        edges = zip(net_AM.row, net_AM.col, net_AM.data)
+    else:
+        rows, cols = np.nonzero(net_AM)
+        edges = zip(rows, cols, net_AM[rows, cols])
+    for r, c, w in edges:
+        if w != 0:
+            net.add_edge(int(c), n_in + int(r), w = float(w))
+
+    return net
+
+# Number of entries of M strictly greater than threshold, without densifying sparse matrices
+def count_greater(M, threshold):
+    if sp.issparse(M):
+        count = (M.data > threshold).sum()
+        # implicit zeros
+        if threshold < 0:
+            count += M.shape[0]*M.shape[1] - M.nnz
+        return count
+    return (M > threshold).sum()
+
 def fitness(net_AM, net_struct):
 
     result = 0
@@ -866,18 +1124,81 @@ def fitness(net_AM, net_struct):
 
     # 2 - I want few, high-value edges
     if net_AM.shape != (1,0):
-        maxedge = np.max(net_AM)
-        nhigh = (net_AM > maxedge*.9).sum()
+        maxedge = net_AM.max()
+        nhigh = count_greater(net_AM, maxedge*.9)
         result += (maxedge * 10)**2
         result -= (5 - nhigh) ** 2
     
-    nedg = (net_AM>0).sum()
+    nedg = count_greater(net_AM, 0)
     result -= nedg
 
 
 
     return result
 
+# --- Population-level fitness ------------------------------------------------------------
+# The (net_AM, net_struct) of a population are packed into padded arrays : node types as codes (-1 for padding),
+# adjacency matrices stacked in (pop, max_rows, max_cols) blocks with a mask of their actual entries.
+# fitness terms are then computed for the whole population in a few reductions.
+node_type_codes = {'IN' : 0, 'NEUP' : 1, 'NEUM' : 2, 'OUT' : 3}
+# node types counted as neurons, with the same test as fitness
+neuron_type_codes = [code for typ, code in node_type_codes.items() if typ[:2] == 'NEU']
+
+def pack_networks(networks):
+    structs = [net_struct for net_AM, net_struct in networks]
+    shapes = np.array([net_AM.shape for net_AM, net_struct in networks], dtype = int).reshape((-1, 2))
+    types = np.full((len(networks), max([len(s) for s in structs], default = 0)), -1, dtype = np.int8)
+    AM = np.zeros((len(networks), *shapes.max(axis = 0, initial = 0)))
+    AM_mask = np.zeros(AM.shape, dtype = bool)
+    for i, (net_AM, net_struct) in enumerate(networks):
+        types[i, :len(net_struct)] = [node_type_codes[typ] for typ in net_struct]
+        rows, cols = shapes[i]
+        if sp.issparse(net_AM):
+            coo = net_AM.tocoo()
+            AM[i, coo.row, coo.col] += coo.data
+        else:
+            AM[i, :rows, :cols] = net_AM
+        AM_mask[i, :rows, :cols] = True
+    # fitness skips the edge terms of networks without body (net_AM = np.array([[]]))
+    has_edges = shapes.prod(axis = 1) > 0
+    return types, AM, AM_mask, has_edges
+
+# Same values as fitness, for every packed network
+def batch_fitness(types, AM, AM_mask, has_edges):
+    nseg = (types == node_type_codes['IN']).sum(axis = 1)
+    nneu = np.isin(types, neuron_type_codes).sum(axis = 1)
+    result = - (10 - nseg)**2 - (5 - nneu)**2.
+
+    maxedge = np.where(AM_mask, AM, -np.inf).max(axis = (1, 2), initial = -np.inf)
+    maxedge = np.where(has_edges, maxedge, 0)
+    nhigh = np.logical_and(AM > maxedge[:, None, None]*.9, AM_mask).sum(axis = (1, 2))
+    result += np.where(has_edges, (maxedge * 10)**2 - (5 - nhigh)**2, 0)
+
+    nedg = np.logical_and(AM > 0, AM_mask).sum(axis = (1, 2))
+    return result - nedg
+
+def population_fitness(networks):
+    if len(networks) == 0:
+        return np.zeros(0)
+    return batch_fitness(*pack_networks(networks))
+
+# Genotype -> (net_AM, net_struct)
+# phenotypes is an optional phenotype_cache, reusing the network built for an identical device list
+def build_network(g, phenotypes = None):
+    all_devs = sum([g.extract_devices(k) for k in range(len(g.chromosomes))], start = [])
+    if phenotypes is None:
+        return g.build_devices(all_devs)
+    return phenotypes.build(g, all_devs)
+
+# Complete genotype -> fitness evaluation of a genome
+def evaluate(g, phenotypes = None):
+    return fitness(*build_network(g, phenotypes))
+
+# Complete evaluation of a population : networks are built through map (e.g. population_evaluator.map),
+# their fitnesses are computed in one batch
+def evaluate_population(population, phenotypes = None, map = map):
+    networks = list(map(partial(build_network, phenotypes = phenotypes), list(population)))
+    return population_fitness(networks).tolist()
 
 
 
@@ -890,6 +1211,15 @@ standard_mutate_rate = np.array([.001, .001, .001,
 
 
 if __name__ == "__main__":
+    # evolution run tools, only needed when running this module (not by the modules, or pool workers, importing it)
+    from AE.AGE.rng_streams import seed_streams
+    from AE.AGE.string_alignement import alignement_history_stats
+    from AE.AGE.caching import fitness_cache, phenotype_cache
+    from AE.AGE.parallel import population_evaluator
+    from AE.AGE.shared_alignement import shared_alignement_history
+    from AE.AGE.steady_state import steady_state_evolve
+    from AE.AGE.islands import island_evolve
+    from AE.AGE.profiler import phase_profiler
 
     print('----------------------------')
             # mutate_funcs = [self.nuc_insert, self.nuc_del, self.nuc_sub, 
@@ -908,50 +1238,137 @@ if __name__ == "__main__":
 
     n_gens = 1000
     n_pop = 100
-    pop = [acrobot_genome() for n in range(n_pop)]
+    # 'generational', 'steady_state' (no generational barrier, n_gens * n_pop evaluations)
+    # or 'islands' (n_islands sub-populations of n_pop // n_islands genomes, in as many processes)
+    evolution_mode = 'generational'
+    n_islands = 4
+    migration_interval = 10
+    migration_size = 2
+    migration_topology = 'ring'
+    # Genomes already evaluated (most offspring are unmutated copies of the elite)
+    cache = fitness_cache(max_size = 10*n_pop)
+    # Networks already built (mutations in non-coding regions do not change the device list)
+    phenotypes = phenotype_cache(max_size = 10*n_pop)
+    # > 1 evaluates the population in a process pool
+    n_workers = 1
+    # workers share their alignment scores instead of each building its own history
+    shared_history = shared_alignement_history() if n_workers > 1 else None
+    evaluator = population_evaluator(n_workers, alignement_history = shared_history)
+    # the phenotype cache lives in this process, so only serial evaluations use it
+    evaluation = partial(evaluate, phenotypes = phenotypes) if n_workers == 1 else evaluate
+    # networks built through the evaluator, fitnesses computed in one batch (generational mode)
+    evaluation_batch = partial(evaluate_population, phenotypes = phenotypes if n_workers == 1 else None, map = evaluator.map)
+
+    # Per-phase timings, one JSON line per generation in profile_path (e.g. 'age_profile.jsonl'); None disables it
+    # Phases run by the evaluator's workers (n_workers > 1) are not timed; in islands mode, each island times its
+    # evaluation, migration, selection and mutation phases (not the phases nested in them)
+    profile_path = None
+    profiler = phase_profiler(enabled = profile_path is not None, path = profile_path)
+    genome.extract_devices = profiler.wrap('extract_devices', genome.extract_devices)
+    acrobot_genome.build_devices = profiler.wrap('build_devices', acrobot_genome.build_devices)
+    score_alignement = profiler.wrap('alignement', score_alignement)
+    # fitness scores single genomes (steady-state mode), population_fitness the batches of the generational loop
+    fitness = profiler.wrap('fitness', fitness)
+    population_fitness = profiler.wrap('fitness', population_fitness)
+    profiler.track('alignement_hits', lambda : alignement_history_stats['hits'])
+    profiler.track('alignement_misses', lambda : alignement_history_stats['misses'])
+
+    # Independent random streams per generation and per individual (generation 0 being the initialization)
+    # AE_AGE_SEED=<printed seed> reproduces a run, whatever n_workers
+    streams = seed_streams()
+    print(f'seed : {streams.entropy}')
+    pop = []
+    for n in range(n_pop):
+        streams.use(0, n)
+        pop.append(acrobot_genome())
     pop = np.array(pop, dtype = object)
     t_last_gen = time()
     time_per_generation = np.zeros(n_gens)
     total_genome_length_per_generation = np.zeros(n_gens)
-    for generation in range(n_gens):
-        t_gen = time() - t_last_gen
-        t_last_gen = time()
-        time_per_generation[generation] = t_gen + .0
-        print(f'--- {generation} --- {round(t_gen, 4)}s')
-        for i, g in enumerate(pop):
-
-            net_foundations = g.build_devices(sum([g.extract_devices(k) for k in range(len(g.chromosomes))], start = []))
+    if evolution_mode == 'islands':
+        islands = island_evolve(acrobot_genome, evaluate, standard_mutate_rate, n_gens, n_islands, n_pop // n_islands,
+                                crossover = partial(population_chrom_cross, p_cc = standard_mutate_rate[10]),
+                                migration_interval = migration_interval, migration_size = migration_size,
+                                topology = migration_topology, streams = streams, profiler = profiler)
+        # records of the slowest island, and genome lengths of all the islands
+        time_per_generation = np.max([island['history']['time'] for island in islands], axis = 0)
+        total_genome_length_per_generation = n_pop * np.mean([island['history']['mean_genome_length'] for island in islands], axis = 0)
+        for i, island in enumerate(islands):
+            print(f'island {i} : best fitness {island["fitnesses"][-1]}')
+        best_island = islands[int(np.argmax([island['fitnesses'][-1] for island in islands]))]
+        for g, fit in zip(best_island['population'], best_island['fitnesses']):
+            g.fitness = fit
+        pop = np.array(best_island['population'], dtype = object)
+    elif evolution_mode == 'steady_state':
+        # a 'generation' is n_pop evaluations, for the records and the final plot
+        def record(n_done, population, fitnesses):
+            global t_last_gen
+            if (n_done + 1) % n_pop == 0:
+                generation = n_done // n_pop
+                time_per_generation[generation] = time() - t_last_gen
+                t_last_gen = time()
+                print(f'--- {generation} --- {round(time_per_generation[generation], 4)}s')
+                total_genome_length_per_generation[generation] = (sum([sum([len(chrom) for chrom in g.chromosomes]) for g in population]))
+                print(total_genome_length_per_generation[generation]/len(population))
+                print(sum(fitnesses)/len(fitnesses), max(fitnesses))
+                profiler.end_generation(generation, time = time_per_generation[generation],
+                                        mean_genome_length = total_genome_length_per_generation[generation]/len(population))
+
+        mutate = profiler.wrap('mutation', lambda g : g.mutate(standard_mutate_rate))
+        pop, fits = steady_state_evolve(pop, evaluation, mutate, evaluator, n_gens*n_pop, callback = record, streams = streams.child(1),
+                                        crossover = partial(pair_chrom_cross, p_cc = standard_mutate_rate[10]))
+        for g, fit in zip(pop, fits):
+            g.fitness = fit
+        # best individual last, as after a generational step
+        pop = np.array(pop, dtype = object)[np.argsort(fits)]
+    else:
+        for generation in range(n_gens):
+            t_gen = time() - t_last_gen
+            t_last_gen = time()
+            time_per_generation[generation] = t_gen + .0
+            print(f'--- {generation} --- {round(t_gen, 4)}s')
             # g.fitness = sum([len(chrom) for chrom in g.chromosomes])
-    
-            g.fitness = fitness(*net_foundations)
-        sorter = np.argsort([g.fitness for g in pop])
-        pop = np.array(pop, dtype = object)[sorter]
-        pop[:-1] = [deepcopy(pop[-1])  for k in range(len(pop)-1)]
-        for n in range(len(pop)-1):
-            try:
-                pop[n].mutate(standard_mutate_rate)
-            except:
-                print([np.array(j) for j in (pop[n].chromosomes)])
-                raise
+            with profiler.phase('evaluation'):
+                # the genomes missing from the cache are evaluated together, fitnesses being computed in one batch
+                fits = cache.evaluate_population(pop, evaluation, evaluate_batch = evaluation_batch)
+            for g, fit in zip(pop, fits):
+                g.fitness = fit
+            fitness_hit_rate, phenotype_hit_rate = cache.new_generation(), phenotypes.new_generation()
+            print(f'fitness cache hit rate : {round(fitness_hit_rate, 3)} - phenotype cache hit rate : {round(phenotype_hit_rate, 3)}')
+            with profiler.phase('selection'):
+                sorter = np.argsort([g.fitness for g in pop])
+                pop = np.array(pop, dtype = object)[sorter]
+                pop[:-1] = [deepcopy(pop[-1])  for k in range(len(pop)-1)]
+            with profiler.phase('mutation'):
+                for n in range(len(pop)-1):
+                    streams.use(generation + 1, n)
+                    try:
+                        pop[n].mutate(standard_mutate_rate)
+                    except:
+                        print([np.array(j) for j in (pop[n].chromosomes)])
+                        raise
+                # the elite (last) is kept unchanged
+                streams.use(generation + 1)
+                population_chrom_cross(pop[:-1], standard_mutate_rate[10])
         
-        total_genome_length_per_generation[generation] = (sum([sum([len(g.chromosomes[k]) for k in range(len(g.chromosomes))]) for g in pop]))
-        print(total_genome_length_per_generation[generation]/len(pop))
-        print(sum([g.fitness for g in pop])/len(pop), max([g.fitness for g in pop]))
-        # total_number_of_devices_per_generation = (sum([sum([len(g.extract_devices(k)) for k in range(len(g.chromosomes))]) for g in pop]))
+            total_genome_length_per_generation[generation] = (sum([sum([len(g.chromosomes[k]) for k in range(len(g.chromosomes))]) for g in pop]))
+            print(total_genome_length_per_generation[generation]/len(pop))
+            print(sum([g.fitness for g in pop])/len(pop), max([g.fitness for g in pop]))
+            profiler.end_generation(generation, time = t_gen, mean_genome_length = total_genome_length_per_generation[generation]/len(pop), 
+                                    fitness_cache_hit_rate = fitness_hit_rate, phenotype_cache_hit_rate = phenotype_hit_rate)
+            # total_number_of_devices_per_generation = (sum([sum([len(g.extract_devices(k)) for k in range(len(g.chromosomes))]) for g in pop]))
+    evaluator.close()
+    profiler.close()
+    if shared_history is not None:
+        print(f'shared alignment history : {len(shared_history)} scores')
+        shared_history.close()
 
     print('----------------------------')
     g = pop[-1]
     all_devs  = g.extract_devices(0)
     anything = g.build_devices(all_devs)
 
-    net = ann.ANN(default_activation='tanh')
-    for node in anything[1]:
-        if node == 'NEUM':
-            act = lambda x : -x
-        else:
-            act = None
-        net.add_node(1, node == 'IN', node == 'OUT', 0, act)
-    add_edges(net, anything[0].T , 5)
+    net = build_net(*anything)
     # print([[(i, j + 3) for j
             #  in range(anything[0].shape[1])] for i in  range(anything[0].shape[1])])
     print(net)
@@ -0,0 +1,144 @@
+# Genome-size scaling benchmark of the genotype -> network pipeline
+#
+# Populations of acrobot_genome are generated at controlled genome sizes and device densities, and
+# extract_devices, build_devices and mutate are timed separately. For each phase, a scaling exponent
+# is fitted on log(time) = exponent * log(size) + c. Results are compared with a baseline file (JSON),
+# and the run fails when an exponent or the time at the largest size regresses beyond tolerance.
+#
+# Run from the repository root : python -m AE.AGE.benchmark
+
+import json
+import os
+import sys
+from copy import deepcopy
+from time import perf_counter
+import numpy as np
+
+from AE.AGE.string_alignement import rng, use_alignement_history
+from AE.AGE.age_genome import acrobot_genome, acrobot_devices, random_sequence, standard_mutate_rate, stik_token
+
+
+# Restarts the shared random generator, so that populations and mutations are identical from run to run
+def reseed(seed):
+    rng.bit_generator.state = np.random.default_rng(seed).bit_generator.state
+
+
+# A single chromosome of about size letters, holding density devices per 1000 letters (at least two segments,
+# so that build_devices has a body to build), separated by random non-coding sequences
+def make_genome(size, density):
+    g = acrobot_genome()
+    n_devices = max(2, int(round(density*size/1000)))
+    devices = [acrobot_devices.generate(stik_token) for i in range(2)] + [acrobot_devices.generate() for i in range(n_devices - 2)]
+    n_noncoding = max(0, size - sum([len(d) for d in devices]))
+    # random split of the non-coding letters between the n_devices + 1 gaps
+    cuts = np.sort(rng.integers(0, n_noncoding + 1, n_devices))
+    gaps = np.diff(np.concatenate(([0], cuts, [n_noncoding])))
+    chrom = list(random_sequence(gaps[0]))
+    for d, gap in zip(devices, gaps[1:]):
+        chrom += d.tolist() + list(random_sequence(gap))
+    g.chromosomes = [chrom]
+    g.update()
+    return g
+
+def make_population(size, density, n_genomes):
+    return [make_genome(size, density) for i in range(n_genomes)]
+
+
+# Best (minimal) total time over repeats, for each phase
+def time_population(pop, repeats = 3):
+    times = {'extract_devices' : np.inf, 'build_devices' : np.inf, 'mutate' : np.inf}
+    for r in range(repeats):
+        t0 = perf_counter()
+        all_devs = [sum([g.extract_devices(k) for k in range(len(g.chromosomes))], start = []) for g in pop]
+        times['extract_devices'] = min(times['extract_devices'], perf_counter() - t0)
+
+        # without alignment history nor the scores memorized by the previous build, so that repeats do not measure cache hits
+        use_alignement_history({'use_count' : 0})
+        for g in pop:
+            g.alignement_memo = None
+            g.edit_log = []
+        t0 = perf_counter()
+        for g, devs in zip(pop, all_devs):
+            g.build_devices(devs)
+        times['build_devices'] = min(times['build_devices'], perf_counter() - t0)
+
+        mutants = deepcopy(pop)
+        t0 = perf_counter()
+        for g in mutants:
+            g.mutate(standard_mutate_rate)
+        times['mutate'] = min(times['mutate'], perf_counter() - t0)
+
+    use_alignement_history({'use_count' : 0})
+    return times
+
+
+def run(sizes = (250, 500, 1000, 2000, 4000), density = 10, n_genomes = 10, repeats = 3, seed = 0, verbose = True):
+    reseed(seed)
+    sizes = np.array(sizes)
+    times = {}
+    for size in sizes:
+        pop = make_population(size, density, n_genomes)
+        for phase, t in time_population(pop, repeats).items():
+            times.setdefault(phase, []).append(t)
+        if verbose:
+            print(f'size {size} : ' + ' - '.join([f'{phase} {round(t[-1], 4)}s' for phase, t in times.items()]))
+
+    results = {}
+    for phase, t in times.items():
+        exponent = np.polyfit(np.log(sizes), np.log(t), 1)[0]
+        results[phase] = {'exponent' : float(exponent), 'time' : float(t[-1]), 'times' : [float(x) for x in t]}
+    results['parameters'] = {'sizes' : sizes.tolist(), 'density' : density, 'n_genomes' : n_genomes, 'repeats' : repeats, 'seed' : seed}
+    return results
+
+
+# Returns the list of regressions of results with respect to baseline
+# time_tolerance is relative (.5 = 50% slower), exponent_tolerance is absolute
+def check(results, baseline, exponent_tolerance = .2, time_tolerance = .5):
+    failures = []
+    if results['parameters'] != baseline['parameters']:
+        failures.append(f"parameters differ from the baseline : {results['parameters']} != {baseline['parameters']}")
+        return failures
+    for phase, ref in baseline.items():
+        if phase == 'parameters':
+            continue
+        if results[phase]['exponent'] > ref['exponent'] + exponent_tolerance:
+            failures.append(f"{phase} : scaling exponent {round(results[phase]['exponent'], 3)} > {round(ref['exponent'], 3)} + {exponent_tolerance}")
+        if results[phase]['time'] > ref['time']*(1 + time_tolerance):
+            failures.append(f"{phase} : {round(results[phase]['time'], 4)}s > {round(ref['time'], 4)}s + {int(100*time_tolerance)}%")
+    return failures
+
+
+if __name__ == "__main__":
+
+    # === Parameters ===========================================================
+
+    sizes = (250, 500, 1000, 2000, 4000)
+    density = 10       # devices per 1000 letters
+    n_genomes = 10
+    repeats = 3
+    seed = 0
+
+    # Created by the first run, delete it to accept new reference timings
+    baseline_path = 'age_benchmark_baseline.json'
+    exponent_tolerance = .2
+    time_tolerance = .5
+
+    # ==========================================================================
+
+    results = run(sizes, density, n_genomes, repeats, seed)
+    for phase, r in results.items():
+        if phase != 'parameters':
+            print(f"{phase} : exponent {round(r['exponent'], 3)}, {round(r['time'], 4)}s at size {sizes[-1]}")
+
+    if not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent = 2)
+        print(f'Baseline written to {baseline_path}')
+        sys.exit(0)
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    failures = check(results, baseline, exponent_tolerance, time_tolerance)
+    for failure in failures:
+        print('REGRESSION -', failure)
+    sys.exit(1 if failures else 0)
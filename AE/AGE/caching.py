@@ -0,0 +1,127 @@
+# Bounded caches to skip the work already done for identical genomes
+# Keys are content hashes, so that clones (deepcopies) share the same entry
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+from AE.AGE.device_codec import pack_chromosomes
+
+# Returned by bounded_cache.get when the key is unknown (None can be a cached value)
+missing = object()
+
+# Fast content hash of all the chromosomes of a genome
+def genome_hash(chromosomes):
+    letters, lengths = pack_chromosomes(chromosomes)
+    h = hashlib.blake2b(digest_size = 16)
+    # the lengths separate chromosomes, so that [[1, 2], [3]] and [[1], [2, 3]] differ
+    h.update(len(lengths).to_bytes(8, 'little'))
+    h.update(lengths.tobytes())
+    h.update(letters.tobytes())
+    return h.digest()
+
+
+# Least recently used cache with a maximal number of entries
+# Hits and misses are counted, and new_generation() stores the hit rate of the generation that just ended
+class bounded_cache():
+    def __init__(self, max_size = 10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.hit_rates = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return missing
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        # evict the least recently used entries
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+    def new_generation(self):
+        calls = self.hits + self.misses
+        hit_rate = self.hits / calls if calls > 0 else 0.0
+        self.hit_rates.append(hit_rate)
+        self.hits = 0
+        self.misses = 0
+        return hit_rate
+
+
+# Genotype -> fitness memoization
+# Unchanged clones (e.g. copies of the elite that no mutation hit) skip extract_devices, build_devices and fitness
+class fitness_cache(bounded_cache):
+    def evaluate(self, g, evaluate):
+        key = genome_hash(g.chromosomes)
+        result = self.get(key)
+        if result is missing:
+            result = evaluate(g)
+            self.put(key, result)
+        return result
+
+    # Same for a whole population, the genomes missing from the cache being evaluated with map
+    # (e.g. a parallel.population_evaluator's map); identical missing genomes are evaluated once
+    # evaluate_batch(genomes) -> fitnesses, if given, evaluates all the missing genomes at once instead
+    # (e.g. age_genome.evaluate_population)
+    def evaluate_population(self, population, evaluate, map = map, evaluate_batch = None):
+        keys = [genome_hash(g.chromosomes) for g in population]
+        results = [self.get(key) for key in keys]
+        to_evaluate = {}
+        for g, key, result in zip(population, keys, results):
+            if result is missing and key not in to_evaluate:
+                to_evaluate[key] = g
+        if evaluate_batch is None:
+            fitnesses = map(evaluate, list(to_evaluate.values()))
+        else:
+            fitnesses = evaluate_batch(list(to_evaluate.values()))
+        evaluated = dict(zip(to_evaluate.keys(), fitnesses))
+        for key, result in evaluated.items():
+            self.put(key, result)
+        return [evaluated[key] if result is missing else result for key, result in zip(keys, results)]
+
+
+# Canonical content hash of an extracted device list (as returned by genome.extract_devices)
+# Each device is a list of (token, sequence) sections, the sequence of the device token being None
+def devices_hash(all_devs):
+    h = hashlib.blake2b(digest_size = 16)
+    for dev in all_devs:
+        h.update(len(dev).to_bytes(8, 'little'))
+        for token, sq in dev:
+            h.update(np.asarray(token, dtype = np.uint8).tobytes())
+            if sq is None:
+                # no sequence is different from an empty sequence
+                h.update(b'\xff' * 8)
+            else:
+                letters = np.asarray(sq, dtype = np.uint8)
+                h.update(len(letters).to_bytes(8, 'little'))
+                h.update(letters.tobytes())
+    return h.digest()
+
+
+# Phenotype memoization : extracted device list -> build_devices result (adjacency matrix, network structure)
+# Mutations outside of the coding regions leave the device list unchanged and skip the alignment-heavy network build
+# A cache should only be shared by genomes of the same class, build_devices being class-specific
+class phenotype_cache(bounded_cache):
+    def build(self, g, all_devs):
+        key = devices_hash(all_devs)
+        result = self.get(key)
+        if result is missing:
+            net_AM, net_struct = g.build_devices(all_devs)
+            # the same objects are handed to every genome hitting this entry : they must not be modified
+            if isinstance(net_AM, np.ndarray):
+                net_AM.flags.writeable = False
+            result = (net_AM, tuple(net_struct))
+            self.put(key, result)
+        return result
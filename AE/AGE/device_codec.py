@@ -0,0 +1,81 @@
+# Conversions between devices in tuple form and their genetic sequences, stored in preallocated uint8 arrays
+# A device in tuple form is a list of (token, sequence) pairs, the first one being (device_token, None) :
+#   [(device_token, None), (term_token, term_sq), ..., (parm_token, parm_sq), ...]
+# In a chromosome, each coding sequence comes right before the token closing it :
+#   device_token term_sq term_token ... parm_sq parm_token
+# Chromosomes are packed the same way (pack_chromosomes) for pickles and content hashes
+# Letters are stored on one byte each everywhere, which check_alphabet enforces on the genetic alphabet
+
+from itertools import chain
+import numpy as np
+from AE.AGE.token_scanner import get_scanner
+
+max_alphabet_size = 256
+
+# Letters have to be integers in range(max_alphabet_size)
+def check_alphabet(alphabet):
+    alphabet = np.asarray(alphabet)
+    assert alphabet.size == 0 or (alphabet.min() >= 0 and alphabet.max() < max_alphabet_size), \
+        f'letters are stored on one byte : the genetic alphabet has to be made of integers in [0, {max_alphabet_size})'
+
+def encoded_size(device_tuples):
+    return sum([len(tk) + (0 if sq is None else len(sq)) for tk, sq in device_tuples])
+
+# Writes the sequence of a device into out, from index start; returns the index following it
+def write_device(device_tuples, out, start = 0):
+    i = start
+    for tk, sq in device_tuples:
+        if sq is not None:
+            out[i:i+len(sq)] = sq
+            i += len(sq)
+        out[i:i+len(tk)] = tk
+        i += len(tk)
+    return i
+
+def encode_device(device_tuples):
+    out = np.empty(encoded_size(device_tuples), dtype = np.uint8)
+    write_device(device_tuples, out)
+    return out
+
+# Sequence of devices separated by non-coding sequences, written into one array:
+#   gaps[0] devices[0] gaps[1] devices[1] ... devices[-1] gaps[-1]
+# gaps holds len(devices) + 1 sequences (possibly empty)
+def encode_layout(devices, gaps):
+    assert len(gaps) == len(devices) + 1, f'{len(gaps)} gaps for {len(devices)} devices'
+    out = np.empty(sum([len(gap) for gap in gaps]) + sum([encoded_size(d) for d in devices]), dtype = np.uint8)
+    out[:len(gaps[0])] = gaps[0]
+    i = len(gaps[0])
+    for d, gap in zip(devices, gaps[1:]):
+        i = write_device(d, out, i)
+        out[i:i+len(gap)] = gap
+        i += len(gap)
+    return out
+
+# Inverse of encode_device for a well-formed device sequence : its device token, then coding sequences closed by
+# term/parm tokens. Tokens and sequences are returned as tuples of ints, as by genome.extract_devices
+def decode_device(sq, term_token, parm_token, token_size = 4, alphabet_size = 20):
+    sq = np.asarray(sq)
+    device_tuples = [(tuple(sq[:token_size].tolist()), None)]
+    last_tk_end = token_size
+    for i, tk in get_scanner((term_token, parm_token), alphabet_size).scan(sq[token_size:]):
+        i += token_size
+        device_tuples.append((tk, tuple(sq[last_tk_end:i].tolist())))
+        last_tk_end = i + len(tk)
+    assert last_tk_end == len(sq), f'{np.array(sq)} does not end with a term/parm token'
+    return device_tuples
+
+
+# --- Chromosome packing ------------------------------------------------------------------
+
+# All the letters of a list of chromosomes in one uint8 array, and the chromosome lengths
+def pack_chromosomes(chromosomes):
+    lengths = np.array([len(chrom) for chrom in chromosomes], dtype = np.int64)
+    letters = np.fromiter(chain.from_iterable(chromosomes), dtype = np.uint8, count = lengths.sum())
+    return letters, lengths
+
+# Chromosomes (lists of ints) from pack_chromosomes' letters (array or bytes) and lengths
+def unpack_chromosomes(letters, lengths):
+    if len(lengths) == 0:
+        return []
+    letters = np.frombuffer(letters, dtype = np.uint8) if isinstance(letters, bytes) else letters
+    return [chrom.tolist() for chrom in np.split(letters, np.cumsum(lengths)[:-1])]
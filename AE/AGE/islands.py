@@ -0,0 +1,157 @@
+# Island model : sub-populations evolving in separate processes, exchanging their best genomes
+#
+# Each island follows the generational scheme of age_genome : after evaluation the best genome is kept and
+# the others are replaced by mutated copies of it. Every migration_interval generations, each island sends
+# copies of its migration_size best genomes to its destination islands, where they replace the worst genomes
+# right before selection.
+# Migrations are synchronous (an island waits for the migrants of all the islands sending to it) and every island
+# draws from its own random streams, so a seeded run gives the same result whatever the scheduling of the processes.
+
+import multiprocessing as mp
+import queue
+from copy import deepcopy
+from time import time
+import numpy as np
+
+from AE.AGE.caching import fitness_cache
+from AE.AGE.profiler import phase_profiler
+from AE.AGE.rng_streams import seed_streams
+
+
+# Destination islands of the migrants of each island
+# topology : 'ring' (i sends to i+1), 'fully_connected' (i sends to every other island),
+# or an explicit list holding the list of destinations of each island
+def migration_destinations(topology, n_islands):
+    if n_islands < 2:
+        return [[] for i in range(n_islands)]
+    if topology == 'ring':
+        return [[(i + 1) % n_islands] for i in range(n_islands)]
+    if topology == 'fully_connected':
+        return [[j for j in range(n_islands) if j != i] for i in range(n_islands)]
+    destinations = [list(d) for d in topology]
+    assert len(destinations) == n_islands, f'{len(destinations)} destination lists for {n_islands} islands'
+    assert all([i not in d for i, d in enumerate(destinations)]), 'an island cannot send migrants to itself'
+    return destinations
+
+
+# --- Island side -------------------------------------------------------------------------
+
+def evaluate_and_sort(population, evaluate, cache):
+    fitnesses = cache.evaluate_population(population, evaluate)
+    order = np.argsort(fitnesses, kind = 'stable')
+    return [population[i] for i in order], [fitnesses[i] for i in order]
+
+# Migrants of generation, from every sender, in the order of the senders
+# Messages of later migrations (from islands running ahead) are kept in pending
+# Genomes travel through the queues pickled, in compact form (see genome.__reduce__)
+def receive_migrants(inbox, pending, generation, n_senders):
+    while len(pending.get(generation, [])) < n_senders:
+        message_generation, sender, genomes, fitnesses = inbox.get()
+        pending.setdefault(message_generation, []).append((sender, genomes, fitnesses))
+    arrivals = sorted(pending.pop(generation, []), key = lambda arrival : arrival[0])
+    migrants = [g for sender, genomes, fitnesses in arrivals for g in genomes]
+    fitnesses = [f for sender, genomes, fitnesses in arrivals for f in fitnesses]
+    return migrants, fitnesses
+
+def run_island(index, config, inbox, outboxes, n_senders, results):
+    streams = config['streams'].child(index)
+    population = []
+    for n in range(config['island_size']):
+        streams.use(0, n)
+        population.append(config['make_genome']())
+    cache = fitness_cache(max_size = 10*config['island_size'])
+    pending = {}
+    history = {'best_fitness' : [], 'mean_genome_length' : [], 'time' : []}
+    # per generation phase records, sent back with the history
+    profiler = phase_profiler(enabled = config['profile'])
+
+    for generation in range(config['n_gens']):
+        t_gen = time()
+        with profiler.phase('evaluation'):
+            population, fitnesses = evaluate_and_sort(population, config['evaluate'], cache)
+
+        if (generation + 1) % config['migration_interval'] == 0 and (outboxes or n_senders):
+            with profiler.phase('migration'):
+                best = slice(len(population) - config['migration_size'], len(population))
+                # copies : the queue pickles them later, from another thread
+                message = (generation, index, [deepcopy(g) for g in population[best]], fitnesses[best])
+                for box in outboxes:
+                    box.put(message)
+                migrants, migrant_fitnesses = receive_migrants(inbox, pending, generation, n_senders)
+                # the migrants replace the worst genomes (fitnesses only depend on the genomes, they are not recomputed)
+                n = min(len(migrants), len(population))
+                population[:n], fitnesses[:n] = migrants[:n], migrant_fitnesses[:n]
+                order = np.argsort(fitnesses, kind = 'stable')
+                population, fitnesses = [population[i] for i in order], [fitnesses[i] for i in order]
+
+        history['best_fitness'].append(fitnesses[-1])
+        history['mean_genome_length'].append(np.mean([sum([len(chrom) for chrom in g.chromosomes]) for g in population]))
+
+        with profiler.phase('selection'):
+            population[:-1] = [deepcopy(population[-1]) for k in range(len(population) - 1)]
+        with profiler.phase('mutation'):
+            for n in range(len(population) - 1):
+                streams.use(generation + 1, n)
+                population[n].mutate(config['mutate_rate'])
+            if config['crossover'] is not None:
+                # the best (last) is kept unchanged
+                streams.use(generation + 1)
+                config['crossover'](population[:-1])
+        history['time'].append(time() - t_gen)
+        profiler.end_generation(generation)
+    history['profile'] = profiler.records
+
+    population, fitnesses = evaluate_and_sort(population, config['evaluate'], cache)
+    results.put((index, population, fitnesses, history))
+
+
+# --- Driver ------------------------------------------------------------------------------
+
+# make_genome() -> new genome, evaluate(genome) -> fitness (both picklable, e.g. acrobot_genome and age_genome.evaluate)
+# mutate_rate is handed to genome.mutate, crossover(population) (e.g. partial(population_chrom_cross, p_cc = .1))
+# is applied to the mutated copies of each generation
+# Returns, for each island : {'population' : genomes (best last), 'fitnesses' : their fitnesses, 'history' : per generation
+# best fitness, mean genome length, time and phase records (empty unless profiled)}
+# profiler (a profiler.phase_profiler) gets one record per generation, holding the phases (evaluation, migration, selection,
+# mutation) of all the islands, the time of the slowest island and the mean genome length; records are written once
+# every island is done
+def island_evolve(make_genome, evaluate, mutate_rate, n_gens, n_islands = 4, island_size = 25, crossover = None,
+                  migration_interval = 10, migration_size = 2, topology = 'ring', streams = None, profiler = None):
+    assert migration_size <= island_size, f'{migration_size} migrants for islands of {island_size} genomes'
+    destinations = migration_destinations(topology, n_islands)
+    n_senders = [sum([i in d for d in destinations]) for i in range(n_islands)]
+    config = {'make_genome' : make_genome, 'evaluate' : evaluate, 'mutate_rate' : mutate_rate, 'crossover' : crossover,
+              'n_gens' : n_gens, 'island_size' : island_size, 'migration_interval' : migration_interval,
+              'migration_size' : migration_size, 'streams' : seed_streams() if streams is None else streams,
+              'profile' : profiler is not None and profiler.enabled}
+
+    inboxes = [mp.Queue() for i in range(n_islands)]
+    results = mp.Queue()
+    processes = [mp.Process(target = run_island,
+                            args = (i, config, inboxes[i], [inboxes[j] for j in destinations[i]], n_senders[i], results))
+                 for i in range(n_islands)]
+    for p in processes:
+        p.start()
+    # results are collected before joining : a process exits only once its queued data has been consumed
+    islands = [None]*n_islands
+    while any([island is None for island in islands]):
+        try:
+            index, population, fitnesses, history = results.get(timeout = 1)
+        except queue.Empty:
+            # an island that died would leave the others waiting for its migrants forever
+            if any([p.exitcode not in (None, 0) for p in processes]):
+                for p in processes:
+                    p.terminate()
+                raise RuntimeError(f'island processes exited with codes {[p.exitcode for p in processes]}')
+            continue
+        islands[index] = {'population' : population, 'fitnesses' : fitnesses, 'history' : history}
+    for p in processes:
+        p.join()
+
+    if config['profile']:
+        for generation in range(n_gens):
+            for island in islands:
+                profiler.merge(island['history']['profile'][generation])
+            profiler.end_generation(generation, time = max([island['history']['time'][generation] for island in islands]),
+                                    mean_genome_length = np.mean([island['history']['mean_genome_length'][generation] for island in islands]))
+    return islands
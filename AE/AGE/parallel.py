@@ -0,0 +1,88 @@
+# Parallel evaluation of genome populations with a process pool
+#
+# Genomes are pickled compactly (see genome.__reduce__) : one byte per letter, chromosome lengths, and their
+# shared configuration (device generator, tokens, alphabet ...) written once per chunk of genomes.
+
+import os
+from multiprocessing import Pool
+import numpy as np
+
+from AE.AGE.string_alignement import use_alignement_history
+
+
+# --- Worker side -------------------------------------------------------------------------
+
+def init_worker(alignement_history = None):
+    if alignement_history is not None:
+        use_alignement_history(alignement_history)
+
+def evaluate_chunk(args):
+    func, chunk = args
+    return [func(item) for item in chunk]
+
+
+# --- Evaluator ---------------------------------------------------------------------------
+
+# Process-pool replacement for map(evaluate, population)
+# Results are returned in order. The population is cut into n_workers * chunks_per_worker chunks,
+# which is enough to balance genomes of uneven sizes while keeping the dispatch overhead low.
+# - DEAP : toolbox.register('map', evaluator.map)
+# - plain loops : fitnesses = evaluator.map(evaluate, pop)
+# With n_workers = 1, evaluation happens in the calling process and no pool is created.
+# alignement_history (e.g. a shared_alignement.shared_alignement_history) replaces the workers' default alignment history.
+class population_evaluator():
+    def __init__(self, n_workers = None, chunks_per_worker = 4, alignement_history = None):
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        self.chunks_per_worker = chunks_per_worker
+        self.alignement_history = alignement_history
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def start(self):
+        self.close()
+        self.pool = Pool(self.n_workers, initializer = init_worker, initargs = (self.alignement_history,))
+
+    def chunks(self, items):
+        n_chunks = min(len(items), self.n_workers * self.chunks_per_worker)
+        bounds = np.linspace(0, len(items), n_chunks + 1).astype(int)
+        return [items[bounds[k]:bounds[k+1]] for k in range(n_chunks)]
+
+    def map(self, func, population):
+        population = list(population)
+        if self.n_workers <= 1 or len(population) == 0:
+            return [func(item) for item in population]
+
+        if self.pool is None:
+            self.start()
+        results = self.pool.map(evaluate_chunk, [(func, chunk) for chunk in self.chunks(population)], chunksize = 1)
+        return [result for chunk in results for result in chunk]
+
+    # Asynchronous evaluation of a single individual : callback(func(item)) is called from a pool thread
+    # as soon as the result is available (immediately with n_workers = 1)
+    def apply_async(self, func, item, callback, error_callback = None):
+        if self.n_workers <= 1:
+            try:
+                result = func(item)
+            except Exception as error:
+                if error_callback is None:
+                    raise
+                error_callback(error)
+            else:
+                callback(result)
+            return
+
+        if self.pool is None:
+            self.start()
+        self.pool.apply_async(evaluate_chunk, ((func, [item]),), 
+                              callback = lambda results : callback(results[0]), error_callback = error_callback)
@@ -0,0 +1,130 @@
+# Per-phase instrumentation of evolution runs
+#
+# Times spent in each phase (mutation, extract_devices, build_devices, alignment, fitness, selection ...) and
+# event counts are accumulated per generation and over the whole run, and written as one JSON line per generation.
+# Phases can be nested (alignment happens inside build_devices), each one then counts its own total time.
+# A disabled profiler hands out a shared no-op context and returns wrapped functions untouched, so that it
+# can be left in the evolution loops at a negligible cost.
+
+import json
+from functools import wraps
+from time import perf_counter
+
+
+class null_phase():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+null = null_phase()
+
+
+class timed_phase():
+    __slots__ = ('profiler', 'name', 't0')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add_time(self.name, perf_counter() - self.t0)
+        return False
+
+
+class phase_profiler():
+    def __init__(self, enabled = True, path = None):
+        self.enabled = enabled
+        self.path = path
+        self.file = open(path, 'w') if (enabled and path is not None) else None
+
+        # current generation
+        self.times = {}
+        self.counts = {}
+        # whole run
+        self.total_times = {}
+        self.total_counts = {}
+        # counters read at the end of each generation : name -> [getter, last value]
+        self.tracked = {}
+
+        self.records = []
+
+    # with profiler.phase('mutation'): ...
+    def phase(self, name):
+        if not self.enabled:
+            return null
+        return timed_phase(self, name)
+
+    def add_time(self, name, t):
+        self.times[name] = self.times.get(name, 0.0) + t
+        self.counts[name + '_calls'] = self.counts.get(name + '_calls', 0) + 1
+
+    def count(self, name, n = 1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    # Returns func, timed as the phase 'name' at each call
+    def wrap(self, name, func):
+        if not self.enabled:
+            return func
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add_time(name, perf_counter() - t0)
+
+        return timed
+
+    # Counter maintained elsewhere (e.g. cache hits), recorded as its increase during each generation
+    def track(self, name, getter):
+        if self.enabled:
+            self.tracked[name] = [getter, getter()]
+
+    # Adds the times and counts of a record made by another profiler (e.g. in another process) to the current generation
+    def merge(self, record):
+        if not self.enabled:
+            return
+        for name, t in record['times'].items():
+            self.times[name] = self.times.get(name, 0.0) + t
+        for name, n in record['counts'].items():
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    # Closes the current generation; extra values (e.g. genome size) are added to its record
+    def end_generation(self, generation, **extra):
+        if not self.enabled:
+            return None
+
+        for name, tracked in self.tracked.items():
+            value = tracked[0]()
+            self.counts[name] = value - tracked[1]
+            tracked[1] = value
+
+        for name, t in self.times.items():
+            self.total_times[name] = self.total_times.get(name, 0.0) + t
+        for name, n in self.counts.items():
+            self.total_counts[name] = self.total_counts.get(name, 0) + n
+
+        record = {'generation' : generation, 'times' : self.times, 'counts' : self.counts, 
+                  'total_times' : dict(self.total_times), 'total_counts' : dict(self.total_counts)}
+        record.update(extra)
+        self.records.append(record)
+        if self.file is not None:
+            self.file.write(json.dumps(record, default = float) + '\n')
+            self.file.flush()
+
+        self.times = {}
+        self.counts = {}
+        return record
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
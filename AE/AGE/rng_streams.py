@@ -0,0 +1,55 @@
+# Random number management of AGE
+# All the modules draw from the one generator rng; reproducibility comes from setting its state from independent
+# SeedSequence streams, one per run, per generation and per individual, before the corresponding draws.
+# The draws made for an individual then only depend on the seed and on its key, and not on the order in which
+# individuals are processed, nor on the number of processes doing it.
+
+import os
+import numpy as np
+
+# Seed of the run : the AE_AGE_SEED environment variable if it is set, fresh entropy otherwise
+seed = os.environ.get('AE_AGE_SEED')
+seed = None if seed is None else int(seed)
+
+rng = np.random.default_rng(seed)
+
+# Sets the state of generator (the shared rng by default) to the start of the stream of a SeedSequence
+def use_sequence(sequence, generator = None):
+    if generator is None:
+        generator = rng
+    generator.bit_generator.state = type(generator.bit_generator)(sequence).state
+
+
+# Keys are tuples of non-negative ints, e.g. (generation, index_in_population); streams of different keys are independent
+# The entropy of the root is kept, so that a run started with seed = None can be reproduced with seed = streams.entropy
+class seed_streams():
+    def __init__(self, seed = seed, key = ()):
+        self.root = np.random.SeedSequence(seed)
+        self.entropy = self.root.entropy
+        self.key = tuple(key)
+
+    # Streams of a sub-part of the run (e.g. one run of a batch, one island), keys being appended to key
+    def child(self, *key):
+        return seed_streams(self.entropy, self.key + key)
+
+    def sequence(self, *key):
+        return np.random.SeedSequence(self.entropy, spawn_key = self.key + key)
+
+    def generator(self, *key):
+        return np.random.default_rng(self.sequence(*key))
+
+    # Sets the shared rng to the stream of key
+    def use(self, *key):
+        use_sequence(self.sequence(*key))
+
+
+# Calls function(item) with the shared rng set to the stream of key + (i,), for the i-th item
+# Items can be processed in any order and by any number of processes : map can be population_evaluator.map
+# Items are mutated in the worker processes, so functions modifying them have to return them
+def seeded_call(args):
+    function, sequence, item = args
+    use_sequence(sequence)
+    return function(item)
+
+def seeded_map(function, items, streams, key = (), map = map):
+    return list(map(seeded_call, [(function, streams.sequence(*key, i), item) for i, item in enumerate(items)]))
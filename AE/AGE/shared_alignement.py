@@ -0,0 +1,121 @@
+# Alignment history shared by several processes
+#
+# Open-addressing (linear probing) hash table over a multiprocessing.shared_memory block, so that
+# the population evaluation workers reuse each other's alignments instead of each growing its own
+# copy of string_alignement.alignement_history.
+#
+# Each slot holds a key (uint64, 0 = empty slot), a check (uint64) and a score (float64). Key and
+# check are two halves of a 128 bits hash of the ordered sequence pair. Slots are never overwritten
+# nor deleted once published, and writers fill the check and the score before publishing the key :
+# reads are lock-free. Inserts take a lock so that two writers never claim the same slot.
+#
+# Only scores are stored : alignments read from the shared history are returned as (None, score),
+# the same signature as score_n_alignment_to_ref.
+
+import hashlib
+from multiprocessing import Lock, shared_memory, resource_tracker
+import numpy as np
+
+
+# Attach to an existing block without letting this process' resource tracker unlink it at exit
+def attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)   # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name = name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class shared_alignement_history():
+    # 24 bytes per slot, plus the number of used slots
+    def __init__(self, n_slots = 2**20, max_load = .7, max_probes = 64, name = None, lock = None):
+        self.n_slots = n_slots
+        self.max_load = max_load
+        self.max_probes = max_probes
+        size = 24*n_slots + 8
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create = True, size = size)
+            self.owner = True
+        else:
+            self.shm = attach_shared_memory(name)
+            self.owner = False
+        self.lock = Lock() if lock is None else lock
+        self.keys = np.ndarray((n_slots,), dtype = np.uint64, buffer = self.shm.buf, offset = 0)
+        self.checks = np.ndarray((n_slots,), dtype = np.uint64, buffer = self.shm.buf, offset = 8*n_slots)
+        self.scores = np.ndarray((n_slots,), dtype = np.float64, buffer = self.shm.buf, offset = 16*n_slots)
+        self.used = np.ndarray((1,), dtype = np.uint64, buffer = self.shm.buf, offset = 24*n_slots)
+        if self.owner:
+            self.keys[:] = 0
+            self.used[0] = 0
+
+        # local (per process) statistics
+        self.hits = 0
+        self.misses = 0
+
+    # Workers attach to the block by name (the lock can only be shared when the worker is created, e.g. in Pool initargs)
+    def __getstate__(self):
+        return {'n_slots' : self.n_slots, 'max_load' : self.max_load, 'max_probes' : self.max_probes, 
+                'name' : self.shm.name, 'lock' : self.lock}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return int(self.used[0])
+
+    def close(self, unlink = None):
+        # views have to be released before the block
+        del self.keys, self.checks, self.scores, self.used
+        self.shm.close()
+        if unlink or (unlink is None and self.owner):
+            self.shm.unlink()
+
+    # seq1 and seq2 are ordered tuples of letters (one byte each, see device_codec.check_alphabet)
+    def hash(self, seq1, seq2):
+        h = hashlib.blake2b(digest_size = 16)
+        h.update(len(seq1).to_bytes(8, 'little'))
+        h.update(bytes(seq1))
+        h.update(bytes(seq2))
+        digest = h.digest()
+        # 0 marks empty slots
+        key = int.from_bytes(digest[:8], 'little') or 1
+        check = int.from_bytes(digest[8:], 'little')
+        return key, check
+
+    # Returns the score, or None if the pair is unknown
+    def lookup(self, seq1, seq2):
+        key, check = self.hash(seq1, seq2)
+        slot = key % self.n_slots
+        for probe in range(self.max_probes):
+            k = self.keys[slot]
+            if k == 0:
+                break
+            if k == key and self.checks[slot] == check:
+                self.hits += 1
+                return float(self.scores[slot])
+            slot = (slot + 1) % self.n_slots
+        self.misses += 1
+        return None
+
+    # Once the table reaches max_load, new pairs are not stored anymore
+    def insert(self, seq1, seq2, score):
+        key, check = self.hash(seq1, seq2)
+        slot = key % self.n_slots
+        with self.lock:
+            if self.used[0] >= self.max_load*self.n_slots:
+                return False
+            for probe in range(self.max_probes):
+                k = self.keys[slot]
+                if k == 0:
+                    self.checks[slot] = check
+                    self.scores[slot] = score
+                    # publishing the slot
+                    self.keys[slot] = key
+                    self.used[0] += 1
+                    return True
+                if k == key and self.checks[slot] == check:
+                    # inserted by another process meanwhile
+                    return False
+                slot = (slot + 1) % self.n_slots
+        return False
@@ -0,0 +1,76 @@
+# Steady-state (asynchronous) evolution
+#
+# There is no generational barrier : a fixed number of offspring evaluations are kept in flight,
+# each result is inserted in the population as soon as it arrives and a new offspring is sent right away.
+# A slow individual (e.g. a bloated genome) then only delays its own insertion, and the throughput is
+# limited by the total amount of work rather than by the slowest individual of each generation.
+
+import queue
+from copy import deepcopy
+
+from AE.AGE.rng_streams import rng, seed_streams
+
+
+# Index of the best of tournsize random individuals
+def tournament(fitnesses, tournsize = 3):
+    contenders = rng.integers(0, len(fitnesses), tournsize)
+    return max(contenders, key = lambda i : fitnesses[i])
+
+
+# population : initial individuals, evaluated first unless their fitnesses are given
+# evaluate(individual) -> fitness, run by evaluator (a parallel.population_evaluator)
+# mutate(individual) modifies a freshly cloned parent in place, in this process
+# crossover(individual, mate), if given, is then applied to it and to a clone of a random member of the population
+# (e.g. age_genome.pair_chrom_cross); only the offspring is kept
+# Each new offspring replaces the worst individual if it is at least as good (fitnesses only need to be comparable)
+# callback(n_done, population, fitnesses) is called after each insertion
+# The selection and mutation of the n-th offspring draw from the stream n of streams (rng_streams.seed_streams) : with
+# one worker a seeded run is reproducible; with more, only the order in which results are inserted can change
+def steady_state_evolve(population, evaluate, mutate, evaluator, n_evaluations, fitnesses = None, 
+                        n_in_flight = None, tournsize = 3, clone = deepcopy, callback = None, streams = None, crossover = None):
+    population = list(population)
+    if fitnesses is None:
+        fitnesses = evaluator.map(evaluate, population)
+    fitnesses = list(fitnesses)
+    if n_in_flight is None:
+        # enough to keep every worker busy while results are being inserted
+        n_in_flight = 2*evaluator.n_workers
+
+    if streams is None:
+        streams = seed_streams()
+
+    results = queue.SimpleQueue()
+
+    def submit(n):
+        streams.use(n)
+        child = clone(population[tournament(fitnesses, tournsize)])
+        mutate(child)
+        if crossover is not None:
+            crossover(child, clone(population[rng.integers(0, len(population))]))
+        evaluator.apply_async(evaluate, child, 
+                              callback = lambda fit : results.put((child, fit, None)), 
+                              error_callback = lambda error : results.put((child, None, error)))
+
+    n_submitted = 0
+    while n_submitted < min(n_in_flight, n_evaluations):
+        submit(n_submitted)
+        n_submitted += 1
+
+    for n_done in range(n_evaluations):
+        child, fit, error = results.get()
+        if error is not None:
+            raise error
+
+        worst = min(range(len(fitnesses)), key = lambda i : fitnesses[i])
+        if not fit < fitnesses[worst]:
+            population[worst] = child
+            fitnesses[worst] = fit
+
+        if callback is not None:
+            callback(n_done, population, fitnesses)
+
+        if n_submitted < n_evaluations:
+            submit(n_submitted)
+            n_submitted += 1
+
+    return population, fitnesses
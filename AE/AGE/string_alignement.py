@@ -2,17 +2,46 @@
 
 import numpy as np
 import copy as cp
-seed = None
-rng = np.random.default_rng(seed)
+from functools import lru_cache
+# the generator shared by all of AGE, see rng_streams for seeding
+from AE.AGE.rng_streams import rng, seed
 
 
 ga = list(range(20))
 
+# Lookup-table transforms : table[c] is the image of letter c
+# They apply to a sequence, or to a padded batch of sequences (2d array), in one indexing
+def transform(table, sq):
+    return table[np.asarray(sq, dtype = np.intp)]
+
+# Applies a table to a list of sequences of different lengths at once; returns a list of arrays
+def transform_batch(table, sequences):
+    if len(sequences) == 0:
+        return []
+    lengths = [len(sq) for sq in sequences]
+    images = transform(table, np.concatenate([np.asarray(sq, dtype = np.intp) for sq in sequences]))
+    return np.split(images, np.cumsum(lengths[:-1]))
+
+# Table sending the i-th letter of source_alphabet (integers) to the i-th letter of target_alphabet
+def remap_table(source_alphabet, target_alphabet):
+    source_alphabet = np.asarray(source_alphabet, dtype = np.intp)
+    target_alphabet = np.asarray(target_alphabet)
+    table = np.zeros(source_alphabet.max() + 1, dtype = target_alphabet.dtype)
+    table[source_alphabet] = target_alphabet
+    return table
+
+# Letter c is complemented by alphabet[c - half alphabet size]
+@lru_cache(maxsize = None)
+def _complement_table(alphabet):
+    alphabet = np.asarray(alphabet)
+    return alphabet[np.arange(len(alphabet)) - int(len(alphabet)/2)]
+
+def complement_table(alphabet = ga):
+    return _complement_table(tuple(alphabet))
+
 # Easy complementary sequences
 def complement_sequence(sq):
-    half_alphabet_size = int(len(ga)/2)
-    sq_comp = [ga[(char) - half_alphabet_size] for char in sq]
-    return sq_comp
+    return transform(complement_table(), sq)
 
 # Determines if there exists a substring of s1 and s2 with exacti matching
 def exact_matching(s1, s2, size = 2):
@@ -141,6 +170,8 @@ def scoring_multi_align_cross(chars1, chars2, padding = np.nan):
 
 
 alignement_history = {'use_count' : 0}
+# hits and misses of score_alignement_with_history_and_silencing, whatever the history
+alignement_history_stats = {'hits' : 0, 'misses' : 0}
 
 # S1 and S2 are iterables of which elements can be compared
 # s1 == s2 is not checked for because it is assumed to be a very rare case
@@ -158,12 +189,22 @@ def order_sequences(s1, s2):
         return s2, s1
 
 
-def score_alignement_with_history(seq1, seq2, gap = -3, history = alignement_history):
+# history defaults to the module-level alignement_history, looked up at call time (see use_alignement_history)
+def score_alignement_with_history(seq1, seq2, gap = -3, history = None):
+    if history is None:
+        history = alignement_history
 
     seq1, seq2 = order_sequences(seq1, seq2)
 
     seq1, seq2 = tuple(seq1), tuple(seq2)
 
+    if not isinstance(history, dict):
+        score = history.lookup(seq1, seq2)
+        if score is None:
+            score = score_alignement(seq1, seq2, gap = gap)[1]
+            history.insert(seq1, seq2, score)
+        return None, score
+
     hus = history['use_count']
     history['use_count'] = hus + 1
  
@@ -188,15 +229,38 @@ def score_alignement_with_silencing(seq1, seq2, gap = -3):
         return score_alignement(seq1, seq2, gap)
 
 
-def score_alignement_with_history_and_silencing(seq1, seq2, gap = -3, history = alignement_history):
+# Replaces the default history of score_alignement_with_history(_and_silencing), 
+# e.g. by a shared_alignement.shared_alignement_history in parallel workers
+def use_alignement_history(history):
+    global alignement_history
+    alignement_history = history
+
+# history defaults to the module-level alignement_history, looked up at call time
+# It can be a dict, or a shared_alignement.shared_alignement_history which only stores scores (alignments are then None)
+def score_alignement_with_history_and_silencing(seq1, seq2, gap = -3, history = None):
+    if history is None:
+        history = alignement_history
+
     seq1, seq2 = order_sequences(seq1, seq2)
 
     seq1, seq2 = tuple(seq1), tuple(seq2)
+
+    if not isinstance(history, dict):
+        score = history.lookup(seq1, seq2)
+        if score is None:
+            alignement_history_stats['misses'] += 1
+            score = score_alignement_with_silencing(seq1, seq2, gap = gap)[1]
+            history.insert(seq1, seq2, score)
+        else:
+            alignement_history_stats['hits'] += 1
+        return None, score
  
     if (seq1, seq2) in history.keys(): 
+        alignement_history_stats['hits'] += 1
         result = history[(seq1, seq2)]['result']
         history[(seq1, seq2)]['count'] += 1
     else:
+        alignement_history_stats['misses'] += 1
         result = score_alignement_with_silencing(seq1, seq2, gap = gap)
         history[(seq1, seq2)] = {'result' : result, 'count' : 1}
     return result
@@ -0,0 +1,75 @@
+# Aho-Corasick automaton finding every token of a token collection in one linear pass over a chromosome
+# Tokens are tuples of letters, letters being integers in range(alphabet_size)
+
+from collections import deque
+
+class token_scanner():
+    def __init__(self, tokens, alphabet_size = 20):
+        self.tokens = frozenset(tokens)
+        self.alphabet_size = alphabet_size
+
+        # trie: goto[state][letter] is the next state, or -1 if there is no edge
+        goto = [[-1] * alphabet_size]
+        output = [None]
+        for tk in self.tokens:
+            state = 0
+            for letter in tk:
+                if goto[state][letter] == -1:
+                    goto[state][letter] = len(goto)
+                    goto.append([-1] * alphabet_size)
+                    output.append(None)
+                state = goto[state][letter]
+            output[state] = tk
+
+        # failure links, breadth first, turning the trie into a complete transition table
+        fail = [0] * len(goto)
+        # all tokens ending at a state (its own and the ones reached through failure links)
+        matches = [[] if tk is None else [tk] for tk in output]
+        queue = deque()
+        for letter in range(alphabet_size):
+            nxt = goto[0][letter]
+            if nxt == -1:
+                goto[0][letter] = 0
+            else:
+                queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            matches[state] += matches[fail[state]]
+            for letter in range(alphabet_size):
+                nxt = goto[state][letter]
+                if nxt == -1:
+                    goto[state][letter] = goto[fail[state]][letter]
+                else:
+                    fail[nxt] = goto[fail[state]][letter]
+                    queue.append(nxt)
+
+        self.delta = goto
+        self.matches = [tuple(m) for m in matches]
+
+    # Returns the (start_index, token) of every token occurence in sq, sorted by start index
+    def scan(self, sq):
+        delta = self.delta
+        matches = self.matches
+        hits = []
+        state = 0
+        for i, letter in enumerate(sq):
+            state = delta[state][letter]
+            if matches[state]:
+                for tk in matches[state]:
+                    hits.append((i + 1 - len(tk), tk))
+        # tokens of different sizes are found by end index
+        hits.sort(key = lambda h : h[0])
+        return hits
+
+
+# One automaton per token collection, built the first time the collection is scanned for
+# add_device_token creates a new collection, and thus a new automaton when it is next needed
+scanners = {}
+def get_scanner(tokens, alphabet_size = 20):
+    key = (frozenset(tokens), alphabet_size)
+    try:
+        return scanners[key]
+    except KeyError:
+        scanner = token_scanner(key[0], alphabet_size)
+        scanners[key] = scanner
+        return scanner
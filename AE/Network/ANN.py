@@ -1,4 +1,6 @@
+import warnings
 import numpy as np
+import scipy.sparse as sp
 
 from AE.Network.Network import Network
 
@@ -74,11 +76,23 @@ def activate(afun, x):
 
   return y    
 
+# === WEIGHT STORAGE =======================================================
+
+'''
+With weight_storage='auto', the weight matrix is stored in CSR format when it
+has at least sparse_min_size entries and a fraction of non-zero entries of at
+most sparse_max_density. Below this size, the overhead of sparse products
+exceeds the cost of the dense ones, whatever the density.
+'''
+
+sparse_min_size = 100000
+sparse_max_density = 0.1
+
 # === NETWORK ==============================================================
 
 class ANN(Network):
 
-  def __init__(self, default_activation='sigmoid', propagation_mode='synchronous'):
+  def __init__(self, default_activation='sigmoid', propagation_mode='synchronous', weight_storage='auto'):
     
     # Parent constructor
     super().__init__(self)
@@ -88,13 +102,23 @@ class ANN(Network):
     # Activation
     self.default_activation = default_activation
 
-    # Propagation
+    # Propagation: 'synchronous' (one step per process call) or 'feedforward'
+    # (all layers in one process call, see propagate)
     self.propagation_mode = propagation_mode
 
+    # Weight matrix storage: 'dense', 'sparse' (CSR) or 'auto'
+    self.weight_storage = weight_storage
+
     #  --- Convenience attributes
     
     self.BULK = []
 
+    # Column of each node in the weight matrix (None for input nodes)
+    self._column = []
+
+    # Index of the (first) node of each name
+    self._index = {}
+
     # Defined during initialization
     self._isInitialized = False
     self.nNd = None
@@ -102,9 +126,14 @@ class ANN(Network):
     self.nBk = None
     self._W = None
     self._bias = None
+    self._response = None
     self._value = None
     self._activation_group = None
 
+    # Defined for the feedforward mode
+    self._layers = None
+    self.recurrent_edges = []
+
   def add_node(self, n=1, IN=False, OUT=False, bias=0., activation=None, initial_value=0., name=None, html=None, response = 1.0):
 
     # --- Checks
@@ -135,17 +164,24 @@ class ANN(Network):
       # Index inputs
       if IN:
         self.IN.append(len(self.node))
+        self._column.append(None)
       else:
+        self._column.append(len(self.BULK))
         self.BULK.append(len(self.node))
 
       # Index outputs
       if OUT:
         self.OUT.append(len(self.node))
 
+      self._index.setdefault(len(self.node) if name is None else name, len(self.node))
       self.node.append({'IN':IN, 'OUT':OUT, 'bias':bias, 'response':response, 'activation':activation, 
         'initial_value':initial_value, 'name': len(self.node) if name is None else name,
         'html': html})
 
+      # Incremental update
+      if self._isInitialized:
+        self._append_node(len(self.node)-1)
+
   def add_edge(self, i, j, w=0., d=0):
 
     # --- Conversion
@@ -153,15 +189,15 @@ class ANN(Network):
     # Emitting node
     if isinstance(i, str):
       try:
-        i = [n['name'] for n in self.node].index(i)
-      except ValueError:
+        i = self._index[i]
+      except KeyError:
         raise ValueError("Cannot find the node '{:s}'.".format(i))
 
     # Receiving node
     if isinstance(j, str):
       try:
-        j = [n['name'] for n in self.node].index(j)
-      except ValueError:
+        j = self._index[j]
+      except KeyError:
         raise ValueError("Cannot find the node '{:s}'.".format(j))
 
     # --- Checks
@@ -171,7 +207,53 @@ class ANN(Network):
     # --- Add edge
 
     self.edge.append({'i':i, 'j':j, 'w':w, 'd':d})
-    
+
+    # Incremental update (edges ending on an input node have no effect)
+    if self._isInitialized and self._column[j] is not None:
+      self._layers = None
+      if sp.issparse(self._W):
+        # Inserting an entry in a CSR matrix is O(nnz), which is still cheaper than a new initialization
+        with warnings.catch_warnings():
+          warnings.simplefilter('ignore', sp.SparseEfficiencyWarning)
+          self._W[i, self._column[j]] = w
+      else:
+        self._W[i, self._column[j]] = w
+
+  def _append_node(self, k):
+    '''
+    Extends the initialized arrays with the last added node k, so that adding
+    nodes to an initialized network does not require a full initialization.
+    The current values are kept, the new node starts at zero.
+    '''
+
+    node = self.node[k]
+
+    self.nNd += 1
+    self._layers = None
+
+    # New row (and column for bulk nodes)
+    if node['IN']:
+      self.nIn += 1
+    else:
+      self.nBk += 1
+
+    if sp.issparse(self._W):
+      self._W.resize((self.nNd, self.nBk))
+    else:
+      self._W = np.pad(self._W, ((0, self.nNd-self._W.shape[0]), (0, self.nBk-self._W.shape[1])))
+
+    if not node['IN']:
+      self._bias = np.append(self._bias, node['bias'])
+      self._response = np.append(self._response, node['response'])
+
+    # Activation group
+    a = node['activation']
+    if a is not None and a!='identity':
+      self._activation_group.setdefault(a, []).append(k)
+
+    # Values
+    self._value = np.pad(self._value, [(0, 0)]*(self._value.ndim-1) + [(0, 1)])
+
   def initialize(self):
 
     # --- Numbers
@@ -182,18 +264,31 @@ class ANN(Network):
 
     # --- Weights
 
-    self._W = np.zeros((self.nNd, self.nBk))
-    for e in self.edge:
-      try:
-        self._W[e['i'], e['j']-sum([i<e['j'] for i in self.IN])] = e['w']
-      except:
-        print(self.nNd, self.nIn, self.nBk)
-        print(self._W)
-        print(self.edge)
-        print(self.IN)
+    # The last edge between two nodes sets the weight
+    # Edges ending on an input node are kept (e.g. for display) but have no effect, inputs being overwritten
+    weight = {(e['i'], self._column[e['j']]): e['w'] for e in self.edge if self._column[e['j']] is not None}
+
+    match self.weight_storage:
+      case 'dense':
+        sparse = False
+      case 'sparse':
+        sparse = True
+      case 'auto':
+        size = self.nNd*self.nBk
+        sparse = size>=sparse_min_size and len(weight)<=sparse_max_density*size
+      case _:
+        raise AttributeError(f"Unknown weight storage '{self.weight_storage}'.")
+
+    rows = np.array([ij[0] for ij in weight], dtype=int)
+    cols = np.array([ij[1] for ij in weight], dtype=int)
+    w = np.array(list(weight.values()), dtype=float)
+
+    if sparse:
+      self._W = sp.csr_matrix((w, (rows, cols)), shape=(self.nNd, self.nBk))
+    else:
+      self._W = np.zeros((self.nNd, self.nBk))
+      self._W[rows, cols] = w
 
-
-        raise      
     # --- Biases
 
     self._bias = np.array([self.node[i]['bias'] for i in self.BULK])
@@ -221,38 +316,164 @@ class ANN(Network):
 
     # --- Values
 
-    self._value = np.zeros(len(self.node))
+    self.reset()
+
+    # --- Layers
+
+    self._layers = None
+    if self.propagation_mode=='feedforward':
+      self.compile_layers()
 
     # Update initialization state
     self._isInitialized = True
 
+  def compile_layers(self):
+    '''
+    Groups the nodes into layers for the feedforward mode.
+
+    Edges closing a cycle (back edges of a depth-first search started from
+    the inputs) are recurrent: they are listed in self.recurrent_edges as
+    (i, j) pairs and reported with a warning. The remaining edges form a
+    directed acyclic graph, where input nodes are in layer 0 and each bulk
+    node is one layer after its deepest predecessor (layer 1 at least).
+    Recurrent edges carry the value of their emitting node at the end of the
+    previous process call.
+    '''
+
+    # --- Successors (edges ending on an input node have no effect)
+
+    succ = [[] for k in range(self.nNd)]
+    for e in self.edge:
+      if self._column[e['j']] is not None and e['j'] not in succ[e['i']]:
+        succ[e['i']].append(e['j'])
+
+    # --- Depth-first search (iterative, for deep networks)
+
+    # 0: unvisited, 1: on the current path, 2: done
+    state = [0]*self.nNd
+    finished = []
+    self.recurrent_edges = []
+
+    for root in self.IN + self.BULK:
+      if state[root]: continue
+      state[root] = 1
+      stack = [(root, iter(succ[root]))]
+      while stack:
+        i, children = stack[-1]
+        for j in children:
+          if state[j]==0:
+            state[j] = 1
+            stack.append((j, iter(succ[j])))
+            break
+          if state[j]==1:
+            self.recurrent_edges.append((i, j))
+        else:
+          state[i] = 2
+          finished.append(i)
+          stack.pop()
+
+    if len(self.recurrent_edges):
+      warnings.warn(f'{len(self.recurrent_edges)} recurrent edges in a feedforward network, they use the values of the previous process call: {self.recurrent_edges}')
+
+    # --- Layer of each node, in topological order
+
+    recurrent = set(self.recurrent_edges)
+    layer = [0]*self.nNd
+    for i in reversed(finished):
+      if self._column[i] is not None:
+        layer[i] = max(layer[i], 1)
+      for j in succ[i]:
+        if (i, j) not in recurrent:
+          layer[j] = max(layer[j], layer[i]+1)
+
+    # --- Layer blocks
+
+    '''
+    Each layer holds its bulk nodes, the columns of _W feeding them and
+    their biases, responses and activation groups (indices within the layer).
+    As in the synchronous mode, the layers read the raw inputs and the
+    activations of the input nodes are applied afterwards.
+    '''
+
+    self._input_activation_group = {}
+    for k in self.IN:
+      a = self.node[k]['activation']
+      if a is not None and a!='identity':
+        self._input_activation_group.setdefault(a, []).append(k)
+
+    nodes = [[] for l in range(max(layer, default=0)+1)]
+    for k in self.BULK:
+      nodes[layer[k]].append(k)
+
+    self._layers = []
+    for lnodes in nodes[1:]:
+      cols = np.array([self._column[k] for k in lnodes], dtype=int)
+      group = {}
+      for p, k in enumerate(lnodes):
+        a = self.node[k]['activation']
+        if a is not None and a!='identity':
+          group.setdefault(a, []).append(p)
+      self._layers.append((lnodes, self._W[:, cols], self._bias[cols], self._response[cols], group))
+
+  def reset(self, n_samples=None):
+    '''
+    Sets all node values to zero.
+
+    With n_samples=None the state is a single vector (nNd,), otherwise it is
+    a matrix (n_samples, nNd) holding the independent states of a batch of
+    samples, each row being propagated as the single vector would be.
+
+    A network that has not been initialized yet is initialized first.
+    '''
+
+    # NB: initialize sets nNd before calling reset
+    if self.nNd is None:
+      self.initialize()
+
+    if n_samples is None:
+      self._value = np.zeros(self.nNd)
+    else:
+      self._value = np.zeros((n_samples, self.nNd))
+
   def process(self, input):
+    '''
+    input is either a single input vector (nIn,), or a batch of input vectors
+    (n_samples, nIn). In the latter case the output is (n_samples, nOut) and
+    each sample has its own state, kept between calls as long as the batch
+    size does not change (a new batch size resets the state).
+    '''
+
+    # Initialize
+    if not self._isInitialized:
+      self.initialize()
+
+    # State shape
+    input = np.asarray(input)
+    shape = (self.nNd,) if input.ndim<2 else (input.shape[0], self.nNd)
+    if self._value.shape!=shape:
+      self.reset(None if input.ndim<2 else input.shape[0])
 
-    if self.propagation_mode=='synchronous':
+    # Update input
+    self._value[..., self.IN] = input
 
-      # Initialize
-      if not self._isInitialized:
-        self.initialize()
+    # Compute new values
+    match self.propagation_mode:
 
-      # Update input
-      self._value[self.IN] = input
+      case 'synchronous':
+        self.step()
 
-      # Compute new values
-      self.step()
+      case 'feedforward':
+        self.propagate()
 
-    return self._value[self.OUT]
+      case _:
+        raise AttributeError(f"Unknown propagation mode '{self.propagation_mode}'.")
+
+    return self._value[..., self.OUT]
 
   def step(self):
     
-    # Weighted sum, bias and response
-    try:
-      self._value[self.BULK] = (self._response * (np.matmul(self._value, self._W) + self._bias)).sum(axis = -1)
-    except:
-      print(self)
-      print(self._value, self._value.shape)
-      print(self.BULK)
-      print(self._response * (np.matmul(self._value, self._W) + self._bias))
-      raise
+    # Weighted sum, bias and response (one matrix product for all samples, dense or sparse weights)
+    self._value[..., self.BULK] = self._response * (self._value @ self._W + self._bias)
     ''' 
     Note:
       Input nodes are set to zero during this operation, but this is not 
@@ -263,4 +484,29 @@ class ANN(Network):
 
     # Activation
     for g in self._activation_group:
-      self._value[self._activation_group[g]] = activate(g, self._value[self._activation_group[g]])
+      self._value[..., self._activation_group[g]] = activate(g, self._value[..., self._activation_group[g]])
+
+  def propagate(self):
+    '''
+    Feedforward propagation: the layers are computed in order, each with one
+    matrix product, so the inputs reach the outputs in a single call.
+    '''
+
+    # Layers are compiled again after nodes or edges have been added
+    if self._layers is None:
+      self.compile_layers()
+
+    for nodes, W, bias, response, group in self._layers:
+
+      # Weighted sum, bias and response
+      x = response * (self._value @ W + bias)
+
+      # Activation
+      for g, k in group.items():
+        x[..., k] = activate(g, x[..., k])
+
+      self._value[..., nodes] = x
+
+    # Input activation
+    for g, nodes in self._input_activation_group.items():
+      self._value[..., nodes] = activate(g, self._value[..., nodes])
@@ -0,0 +1,146 @@
+"""
+Population of ANNs evaluated together
+
+The class :class:`.Population` packs many :class:`AE.Network.ANN.ANN`
+instances, possibly with different topologies, into padded stacked tensors
+so that one step of the whole population is a single batched operation.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from AE.Network.ANN import activate
+
+class Population():
+  """
+  Stacked ANNs
+
+  Network k of the population has its nodes at positions 0..nNd_k-1 of the
+  stacked tensors, positions beyond being padding (masked out, with zero
+  weights, bias and value). The stacked network is synchronous and gives the
+  same outputs as the individual networks processed one by one.
+
+  Attributes:
+    nPop (int): Number of networks.
+    nNd (int): Largest number of nodes.
+    nIn (int): Largest number of inputs.
+    nOut (int): Largest number of outputs.
+    in_mask (np.Array): (nPop, nIn), True for the actual inputs of each network.
+    out_mask (np.Array): (nPop, nOut), True for the actual outputs of each network.
+  """
+
+  def __init__(self, networks):
+    """
+    Args:
+      networks ([ANN]): The networks, initialized here if they are not yet.
+    """
+
+    for net in networks:
+      if net.propagation_mode!='synchronous':
+        raise ValueError(f"Only synchronous networks can be stacked, not '{net.propagation_mode}' ones.")
+      if not net._isInitialized:
+        net.initialize()
+
+    # --- Numbers
+
+    self.nPop = len(networks)
+    self.nNd = max([net.nNd for net in networks], default=0)
+    self.nIn = max([net.nIn for net in networks], default=0)
+    self.nOut = max([len(net.OUT) for net in networks], default=0)
+
+    # --- Masks
+
+    self.node_mask = np.zeros((self.nPop, self.nNd), dtype=bool)
+    self.in_mask = np.zeros((self.nPop, self.nIn), dtype=bool)
+    self.out_mask = np.zeros((self.nPop, self.nOut), dtype=bool)
+    self._bulk_mask = np.zeros((self.nPop, self.nNd), dtype=bool)
+
+    # --- Weights, biases and responses
+
+    '''
+    Contrary to ANN._W, the columns of _W are all the nodes (input columns
+    stay at zero), so that rows and columns share the same node indices.
+    '''
+
+    self._W = np.zeros((self.nPop, self.nNd, self.nNd))
+    self._bias = np.zeros((self.nPop, self.nNd))
+    self._response = np.zeros((self.nPop, self.nNd))
+
+    # --- Inputs and outputs (flat indices into the stacked values)
+
+    in_net, in_pos, in_node = [], [], []
+    out_node = np.zeros((self.nPop, self.nOut), dtype=int)
+
+    # --- Activation groups (masks over the stacked values)
+
+    self._activation_group = {}
+
+    for k, net in enumerate(networks):
+
+      self.node_mask[k, :net.nNd] = True
+      self._bulk_mask[k, net.BULK] = True
+      self.in_mask[k, :net.nIn] = True
+      self.out_mask[k, :len(net.OUT)] = True
+
+      self._W[k][np.ix_(np.arange(net.nNd), np.array(net.BULK, dtype=int))] = net._W.toarray() if sp.issparse(net._W) else net._W
+      self._bias[k, net.BULK] = net._bias
+      self._response[k, net.BULK] = net._response
+
+      in_net += [k]*net.nIn
+      in_pos += list(range(net.nIn))
+      in_node += net.IN
+      out_node[k, :len(net.OUT)] = net.OUT
+
+      for g, nodes in net._activation_group.items():
+        if g not in self._activation_group:
+          self._activation_group[g] = np.zeros((self.nPop, self.nNd), dtype=bool)
+        self._activation_group[g][k, nodes] = True
+
+    self._in_net = np.array(in_net, dtype=int)
+    self._in_pos = np.array(in_pos, dtype=int)
+    self._in_node = np.array(in_node, dtype=int)
+    self._out_node = out_node
+
+    # --- Values
+
+    self.reset()
+
+  def __len__(self):
+    return self.nPop
+
+  def reset(self):
+    '''
+    Sets all node values to zero.
+    '''
+
+    self._value = np.zeros((self.nPop, self.nNd))
+
+  def process(self, input):
+    '''
+    input is either one input vector (nIn,) shared by all networks, or one
+    input vector per network (nPop, nIn). Network k reads the first nIn_k
+    values of its input vector.
+
+    Returns the outputs (nPop, nOut), padded with zeros for the networks with
+    less than nOut outputs (see out_mask).
+    '''
+
+    input = np.broadcast_to(input, (self.nPop, self.nIn))
+
+    # Update input
+    self._value[self._in_net, self._in_node] = input[self._in_net, self._in_pos]
+
+    # Compute new values
+    self.step()
+
+    return np.where(self.out_mask, np.take_along_axis(self._value, self._out_node, axis=1), 0.)
+
+  def step(self):
+
+    # Weighted sum, bias and response, for all networks at once
+    bulk = self._response * (np.matmul(self._value[:, None, :], self._W)[:, 0, :] + self._bias)
+    self._value = np.where(self._bulk_mask, bulk, self._value)
+
+    # Activation
+    for g, mask in self._activation_group.items():
+      self._value[mask] = activate(g, self._value[mask])
@@ -0,0 +1,48 @@
+import numpy as np
+from AE.Network.ANN import ANN
+
+'''
+Feedforward vs synchronous propagation
+
+On an acyclic network, one feedforward process call gives the fixed point
+reached by the synchronous mode after as many calls as the network has
+layers, with the same (constant) input. Some input nodes have an activation.
+'''
+
+rng = np.random.default_rng(0)
+
+for k in range(100):
+
+  Net = {}
+  for mode in ('synchronous', 'feedforward'):
+    Net[mode] = ANN(propagation_mode=mode)
+
+  # Nodes
+  nodes = [dict(IN=True, activation=a) for a in (None, 'tanh', 'sigmoid')]
+  for i in range(12):
+    nodes.append(dict(OUT=i>=10, bias=rng.normal(), response=rng.uniform(0.5, 2), activation=rng.choice(['sigmoid', 'tanh', 'identity'])))
+  for N in Net.values():
+    for node in nodes:
+      N.add_node(**node)
+
+  # Edges, from lower to higher indices (acyclic)
+  for i in range(30):
+    j = int(rng.integers(3, len(nodes)))
+    i = int(rng.integers(0, j))
+    w = rng.normal()
+    for N in Net.values():
+      N.add_edge(i, j, w=w)
+
+  # Batch of constant inputs
+  X = rng.normal(size=(5, 3))
+
+  out = Net['feedforward'].process(X)
+  assert Net['feedforward'].recurrent_edges==[]
+
+  for t in range(len(Net['feedforward']._layers)):
+    ref = Net['synchronous'].process(X)
+
+  assert np.allclose(out, ref), (out, ref)
+  assert np.allclose(Net['feedforward']._value, Net['synchronous']._value)
+
+print('Feedforward and synchronous propagations match.')
@@ -0,0 +1,67 @@
+import numpy as np
+from AE.Network.ANN import ANN
+
+'''
+Incremental vs full initialization
+
+Nodes and edges added to an initialized network update its arrays in place.
+The result is the same as a new initialization of a network built with the
+same nodes and edges: weights, biases, responses, activation groups and
+outputs over several steps.
+'''
+
+rng = np.random.default_rng(0)
+
+def random_node():
+  IN = rng.uniform()<0.2
+  return dict(IN=IN, OUT=not IN and rng.uniform()<0.3, bias=rng.normal(), response=rng.uniform(0.5, 2),
+    activation=None if IN else rng.choice(['sigmoid', 'tanh', 'identity']))
+
+for k in range(100):
+
+  Net = {}
+  for mode in ('incremental', 'fresh'):
+    Net[mode] = ANN(weight_storage='dense')
+
+  # Initial network
+  nodes = [dict(IN=True), dict(OUT=True)] + [random_node() for i in range(int(rng.integers(0, 6)))]
+  edges = []
+
+  for node in nodes:
+    Net['incremental'].add_node(**node)
+  Net['incremental'].initialize()
+
+  # Additions, interleaved
+  for a in range(20):
+
+    if rng.uniform()<0.3:
+      node = random_node()
+      nodes.append(node)
+      Net['incremental'].add_node(**node)
+
+    else:
+      edge = dict(i=int(rng.integers(0, len(nodes))), j=int(rng.integers(0, len(nodes))), w=rng.normal())
+      edges.append(edge)
+      Net['incremental'].add_edge(**edge)
+
+  # Fresh network
+  for node in nodes:
+    Net['fresh'].add_node(**node)
+  for edge in edges:
+    Net['fresh'].add_edge(**edge)
+  Net['fresh'].initialize()
+
+  I, F = Net['incremental'], Net['fresh']
+  assert (I.nNd, I.nIn, I.nBk)==(F.nNd, F.nIn, F.nBk)
+  assert np.array_equal(I._W, F._W)
+  assert np.array_equal(I._bias, F._bias)
+  assert np.array_equal(I._response, F._response)
+  assert I._activation_group==F._activation_group
+
+  # Outputs over several steps, from the same state
+  I.reset()
+  for t in range(5):
+    X = rng.normal(size=(3, I.nIn))
+    assert np.allclose(I.process(X), F.process(X))
+
+print('Incremental and full initializations match.')
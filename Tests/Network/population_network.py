@@ -0,0 +1,49 @@
+import numpy as np
+from AE.Network.ANN import ANN
+from AE.Network.Population import Population
+
+'''
+Population vs individual networks
+
+A population of recurrent networks with different numbers of inputs, outputs
+and nodes gives, at each step, the outputs of its networks processed one by
+one. Inputs and outputs are interleaved with the other nodes.
+'''
+
+rng = np.random.default_rng(0)
+
+for k in range(20):
+
+  nets = []
+  for n in range(int(rng.integers(1, 8))):
+
+    N = ANN()
+
+    # Nodes
+    nIn = int(rng.integers(1, 4))
+    nOut = int(rng.integers(1, 4))
+    kind = rng.permutation(['IN']*nIn + ['OUT']*nOut + ['']*int(rng.integers(0, 10)))
+    for s in kind:
+      N.add_node(IN=s=='IN', OUT=s=='OUT', bias=rng.normal(), response=rng.uniform(0.5, 2),
+        activation=None if s=='IN' else rng.choice(['sigmoid', 'tanh', 'identity']))
+
+    # Edges, recurrent ones included
+    for e in range(int(rng.integers(0, 3*len(kind)))):
+      N.add_edge(int(rng.integers(0, len(kind))), int(rng.integers(0, len(kind))), w=rng.normal())
+
+    nets.append(N)
+
+  P = Population(nets)
+
+  # Several recurrent steps, one input vector per network
+  for t in range(6):
+
+    X = rng.normal(size=(P.nPop, P.nIn))
+    out = P.process(X)
+
+    for i, N in enumerate(nets):
+      ref = N.process(X[i, :N.nIn])
+      assert np.allclose(out[i, :len(N.OUT)], ref), (t, i, out[i], ref)
+      assert np.all(out[i, len(N.OUT):]==0)
+
+print('Population and individual networks match.')
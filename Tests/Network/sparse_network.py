@@ -0,0 +1,67 @@
+import numpy as np
+import scipy.sparse as sp
+from AE.Network.ANN import ANN
+
+'''
+Sparse vs dense weight storage
+
+A network with its weights in CSR format gives the same outputs as the same
+network with dense weights, for single and batched inputs, in both
+propagation modes and after incremental additions of nodes and edges.
+'''
+
+rng = np.random.default_rng(0)
+
+for k in range(100):
+
+  mode = 'feedforward' if k%2 else 'synchronous'
+
+  Net = {}
+  for storage in ('dense', 'sparse'):
+    Net[storage] = ANN(propagation_mode=mode, weight_storage=storage)
+
+  # Nodes
+  nodes = [dict(IN=True, activation=a) for a in (None, 'tanh')]
+  for i in range(20):
+    nodes.append(dict(OUT=i>=17, bias=rng.normal(), response=rng.uniform(0.5, 2), activation=rng.choice(['sigmoid', 'tanh', 'identity'])))
+  for N in Net.values():
+    for node in nodes:
+      N.add_node(**node)
+
+  # Few edges (acyclic in feedforward mode)
+  for e in range(25):
+    j = int(rng.integers(2, len(nodes)))
+    i = int(rng.integers(0, j if mode=='feedforward' else len(nodes)))
+    w = rng.normal()
+    for N in Net.values():
+      N.add_edge(i, j, w=w)
+
+  for N in Net.values():
+    N.initialize()
+  assert sp.issparse(Net['sparse']._W) and not sp.issparse(Net['dense']._W)
+  assert np.array_equal(Net['sparse']._W.toarray(), Net['dense']._W)
+
+  # Single, then batched inputs
+  for t in range(4):
+    x = rng.normal(size=2)
+    assert np.allclose(Net['sparse'].process(x), Net['dense'].process(x))
+  for t in range(4):
+    X = rng.normal(size=(5, 2))
+    assert np.allclose(Net['sparse'].process(X), Net['dense'].process(X))
+
+  # Incremental additions
+  for N in Net.values():
+    N.add_node(OUT=True, bias=0.5, activation='tanh')
+  for e in range(5):
+    i = int(rng.integers(0, len(nodes)))
+    w = rng.normal()
+    for N in Net.values():
+      N.add_edge(i, len(nodes), w=w)
+
+  assert sp.issparse(Net['sparse']._W)
+  assert np.array_equal(Net['sparse']._W.toarray(), Net['dense']._W)
+  for t in range(4):
+    X = rng.normal(size=(5, 2))
+    assert np.allclose(Net['sparse'].process(X), Net['dense'].process(X))
+
+print('Sparse and dense weight storages match.')